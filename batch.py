@@ -0,0 +1,125 @@
+"""Scoring of all models excerpt by excerpt. The true continuation of an
+excerpt is prepared once (sorted and split at the cutoffs for the cardinality
+score, counted for the pitch score) and the outputs of all models are scored
+against it, instead of preparing it again for every model as `cs.score_cs`
+and `pitch.score_pitch` do."""
+import time
+
+import numpy as np
+import pandas as pd
+
+from corpus import as_corpus
+from cs import (EVALUATE_FROM_ONSET, EVALUATE_UNTIL_ONSET, ONSET_INCREMENT,
+                continuation_scores_models)
+from matching import match_model_outputs
+from parallel import map_tasks
+from pitch import pitch_scores_models
+import profiling
+
+
+def score_models(fn_list, alg_names, files_dict, cont_true, prime, n_jobs=1,
+                 chunksize=None, matches=None):
+    '''Compute the cardinality and pitch scores of all models, one excerpt
+    (with the outputs of all models) per task.
+
+    Parameters
+    ----------
+    fn_list : list[str]
+        The file names of the excerpts
+    alg_names : list[str]
+        The models
+    files_dict : dict
+        The outputs of every model, as a `corpus.Corpus` or a dictionary of
+        dataframes
+    cont_true : corpus.Corpus or dict
+        The true continuations
+    prime : corpus.Corpus or dict
+        The primes
+    n_jobs : int, optional
+        The number of worker processes, see `parallel.map_tasks`
+    chunksize : int, optional
+        The number of excerpts sent to a worker at once
+    matches : dict, optional
+        The output file of every model for every excerpt, as returned by
+        `matching.match_model_outputs`
+
+    Returns
+    -------
+    card_df : pd.DataFrame
+        The cardinality scores per onset, as returned by `cs.score_cs`
+    scores_df : pd.DataFrame
+        The pitch scores, as returned by `pitch.score_pitch`
+    '''
+    cont_true = as_corpus(cont_true)
+    prime = as_corpus(prime)
+    alg_names = list(alg_names)
+    files_dict = {alg: as_corpus(files_dict[alg]) for alg in alg_names}
+    fn_list = list(fn_list)
+    if matches is None:
+        matches = match_model_outputs(fn_list, files_dict, alg_names)
+    print(f'Scoring {len(alg_names)} models with cardinality and pitch '
+          'scores')
+    tasks = [
+        (cont_true.points(fn),
+         # the generated file name may have additions to original file name
+         [files_dict[alg].points(matches[alg][fn]) for alg in alg_names],
+         float(prime.points(fn)[0][-1]))
+        for fn in fn_list
+    ]
+    results = map_tasks(_score_models_task, tasks, n_jobs, chunksize,
+                        fn_list)
+    if results:
+        # the times of every model summed over the excerpts (which overlap
+        # in time with several worker processes); the peak memory use is
+        # that of the scoring of all models
+        timings = np.sum([result[2] for result in results], axis=0)
+        for alg, (cs_times, pitch_times) in zip(alg_names, timings):
+            profiling.add_stage('cs', alg, *cs_times)
+            profiling.add_stage('pitch', alg, *pitch_times)
+    # the tables are ordered by model, then excerpt, as those of `score_cs`
+    # and `score_pitch`
+    card_scores = []
+    pitch_scores = []
+    for i, alg in enumerate(alg_names):
+        for fn, (cs_scores, pitch_model_scores, _) in zip(fn_list, results):
+            cs_score = pd.DataFrame(cs_scores[i])
+            cs_score['fn'] = fn
+            cs_score['Model'] = alg
+            card_scores.append(cs_score)
+            pitch_scores.append(
+                {'fn': fn,
+                 'Pitch': pitch_model_scores[i][0],
+                 'Modulo12Pitch': pitch_model_scores[i][1],
+                 'Model': alg}
+            )
+    return pd.concat(card_scores, axis=0), pd.DataFrame(pitch_scores)
+
+
+def _score_models_task(task):
+    """Score the outputs of all models for one excerpt in a worker process,
+    from the onsets and pitches of the true continuation, those of every
+    output, and the last onset of the prime. Also returns the wall and CPU
+    time of the scores of every model, in an array of shape (number of
+    models, 2 scores, 2 clocks); the pitch scores of all models are computed
+    at once, so their time is split evenly between the models."""
+    (true_onsets, true_pitches), outputs, prime_final_onset = task
+    cs_times = []
+    cs_scores = continuation_scores_models(
+        np.column_stack((true_onsets, true_pitches)).astype(float),
+        [np.column_stack((gen_onsets, gen_pitches)).astype(float)
+         for gen_onsets, gen_pitches in outputs],
+        prime_final_onset,
+        ONSET_INCREMENT, EVALUATE_FROM_ONSET, EVALUATE_UNTIL_ONSET,
+        timings=cs_times
+    )
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    pitch_scores = pitch_scores_models(
+        true_pitches, [gen_pitches for gen_onsets, gen_pitches in outputs])
+    pitch_times = np.array([time.perf_counter() - start_wall,
+                            time.process_time() - start_cpu])
+    timings = np.stack([
+        np.array(cs_times).reshape(len(outputs), 2),
+        np.broadcast_to(pitch_times / max(len(outputs), 1),
+                        (len(outputs), 2))
+    ], axis=1)
+    return cs_scores, pitch_scores, timings
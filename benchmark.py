@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+"""Benchmark the evaluation on synthetic PPTD-like datasets of several sizes.
+Writes the timings to a JSON file, so that they can be compared between
+versions of the code.
+
+A synthetic dataset consists of prime, true continuation and model output csv
+files, laid out like the PPTD, with random onsets and pitches. The chord
+density is the fraction of events which sound together with the previous
+event: 0 gives monophonic excerpts. The model outputs are copies of the true
+continuation of which part of the events is moved in time or pitch, so that
+they are scored with a realistic mix of matching and non-matching events.
+"""
+import argparse
+import json
+import os
+import os.path as op
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from cache import COLNAMES
+from corpus import dedup_and_preproc
+from cs import (EVALUATE_FROM_ONSET, EVALUATE_UNTIL_ONSET, METHODS,
+                ONSET_INCREMENT, evaluate_continuation, evaluate_cs)
+from evaluate_discrimination import get_scores
+from pitch import evaluate_pitch_score
+
+# The default dataset sizes, as (number of excerpts, events per excerpt)
+SIZES = [(20, 25), (20, 100), (20, 400)]
+# The default chord densities
+CHORD_DENSITIES = [0.0, 0.5]
+# The default numbers of rows of the discrimination probability matrices
+DISCRIMINATION_ROWS = [10**4, 10**5, 10**6]
+# Number of candidate continuations per row of the discrimination matrices
+NR_CANDIDATES = 4
+# Names and csv columns of the synthetic model outputs
+MODEL_KEYS = {'model1': ['onset', 'pitch'], 'model2': ['onset', 'pitch']}
+# Fraction of the events of the true continuation a model changes
+CHANGE_FRACTION = 0.5
+# Possible time between onsets, in beats
+ONSET_STEPS = np.array([0.25, 0.5, 1.0])
+# Number of timings of which the fastest is reported
+REPEAT = 3
+# The script that runs the end-to-end evaluation
+EVALUATION_SCRIPT = op.join(op.dirname(op.abspath(__file__)),
+                            'evaluate_prediction.py')
+
+
+def generate_events(rng, nr_events, chord_density, start=0.0):
+    """Random events in the format of the PPTD csv files, as a dataframe with
+    the columns of `cache.COLNAMES`, starting at onset `start`"""
+    steps = rng.choice(ONSET_STEPS, nr_events)
+    steps[rng.random_sample(nr_events) < chord_density] = 0.0
+    steps[0] = 0.0
+    pitches = rng.randint(48, 84, nr_events)
+    return pd.DataFrame({
+        'onset': start + np.cumsum(steps),
+        'pitch': pitches,
+        'morph': (pitches * 7) // 12 + 32,
+        'dur': rng.choice(ONSET_STEPS, nr_events),
+        'ch': 0
+    }, columns=COLNAMES)
+
+
+def generate_output(rng, cont_true):
+    """A model output for the true continuation `cont_true`, in which
+    `CHANGE_FRACTION` of the events is moved in time or in pitch"""
+    output = cont_true[['onset', 'pitch']].copy()
+    changed = rng.random_sample(len(output)) < CHANGE_FRACTION
+    in_time = changed & (rng.random_sample(len(output)) < 0.5)
+    in_pitch = changed & ~in_time
+    output.loc[in_time, 'onset'] += rng.choice(ONSET_STEPS, in_time.sum())
+    output.loc[in_pitch, 'pitch'] += rng.randint(-7, 8, in_pitch.sum())
+    return output.sort_values('onset', kind='mergesort')
+
+
+def generate_dataset(root, nr_excerpts, nr_events, chord_density, seed=0):
+    '''Write a synthetic PPTD-like dataset, with the layout expected by
+    `evaluate_prediction.py`.
+
+    Parameters
+    ----------
+    root : str
+        The directory to write the dataset to; it gets the subdirectories
+        'prime_csv', 'cont_true_csv' and one for each model in `MODEL_KEYS`
+    nr_excerpts : int
+        The number of excerpts
+    nr_events : int
+        The number of events in each prime and continuation
+    chord_density : float
+        The fraction of events sounding together with the previous event
+    seed : int, optional
+        The seed of the random generator
+
+    Returns
+    -------
+    output : dict[str]
+        The model directories, as the `MODEL_DIRS` of a config file
+    '''
+    rng = np.random.RandomState(seed)
+    model_dirs = {alg: op.join(root, alg) for alg in MODEL_KEYS}
+    for directory in ['prime_csv', 'cont_true_csv'] + list(MODEL_KEYS):
+        os.makedirs(op.join(root, directory), exist_ok=True)
+    for i in range(nr_excerpts):
+        fn = f'{seed:04d}{i:08d}'
+        prime = generate_events(rng, nr_events, chord_density)
+        cont_true = generate_events(rng, nr_events, chord_density,
+                                    prime['onset'].iloc[-1] + 1.0)
+        prime.to_csv(op.join(root, 'prime_csv', f'{fn}.csv'),
+                     header=False, index=False)
+        cont_true.to_csv(op.join(root, 'cont_true_csv', f'{fn}.csv'),
+                         header=False, index=False)
+        for alg in MODEL_KEYS:
+            # model outputs may add to the original file name
+            generate_output(rng, cont_true).to_csv(
+                op.join(model_dirs[alg], f'{fn}-{alg}.csv'),
+                header=False, index=False)
+    return model_dirs
+
+
+def load_excerpts(root):
+    """Read the primes, true continuations and outputs of the first model of
+    a synthetic dataset, as a list of (prime, true, generated) dataframes"""
+    alg = next(iter(MODEL_KEYS))
+    excerpts = []
+    for name in sorted(os.listdir(op.join(root, 'prime_csv'))):
+        fn = op.splitext(name)[0]
+        prime = pd.read_csv(op.join(root, 'prime_csv', name), names=COLNAMES)
+        cont_true = dedup_and_preproc(pd.read_csv(
+            op.join(root, 'cont_true_csv', name), names=COLNAMES))
+        generated = dedup_and_preproc(pd.read_csv(
+            op.join(root, alg, f'{fn}-{alg}.csv'), names=MODEL_KEYS[alg]))
+        excerpts.append((prime, cont_true, generated))
+    return excerpts
+
+
+def best_time(func, repeat=REPEAT):
+    """The shortest wall time of `repeat` calls of `func`, in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def benchmark_scores(excerpts, repeat=REPEAT):
+    """Time `evaluate_cs` (with each method), `evaluate_continuation` and
+    `evaluate_pitch_score` over all excerpts, as a dictionary of seconds"""
+    timings = {}
+    for method in METHODS:
+        timings[f'evaluate_cs[{method}]'] = best_time(lambda: [
+            evaluate_cs(cont_true, generated, method=method)
+            for prime, cont_true, generated in excerpts
+        ], repeat)
+    timings['evaluate_continuation'] = best_time(lambda: [
+        evaluate_continuation(
+            cont_true, generated, prime['onset'].iloc[-1], ONSET_INCREMENT,
+            EVALUATE_FROM_ONSET, EVALUATE_UNTIL_ONSET)
+        for prime, cont_true, generated in excerpts
+    ], repeat)
+    timings['evaluate_pitch_score'] = best_time(lambda: [
+        evaluate_pitch_score(cont_true, generated)
+        for prime, cont_true, generated in excerpts
+    ], repeat)
+    return timings
+
+
+def benchmark_discrimination(nr_rows, seed=0, repeat=REPEAT):
+    """Time `get_scores` on a random probability matrix of `nr_rows` rows"""
+    rng = np.random.RandomState(seed)
+    x = rng.dirichlet(np.ones(NR_CANDIDATES), nr_rows)
+    return best_time(lambda: get_scores(x), repeat)
+
+
+def benchmark_end_to_end(root, model_dirs, jobs=1):
+    """Time a run of `evaluate_prediction.py` on the dataset in `root`, with a
+    config file written for it. Returns the wall time in seconds."""
+    output_folder = op.join(root, 'output')
+    os.makedirs(output_folder, exist_ok=True)
+    with open(op.join(root, 'config.py'), 'w') as f:
+        f.write(f'DATASET_PATH = {root!r}\n'
+                f'OUTPUT_FOLDER = {output_folder!r}\n'
+                f'MODEL_DIRS = {model_dirs!r}\n'
+                f'MODEL_KEYS = {MODEL_KEYS!r}\n'
+                "FILENAME_FRAGMENT = 'benchmark'\n")
+    # the config file of the dataset takes precedence over the one next to
+    # the script, as the current directory comes first on the path
+    env = dict(os.environ, MPLBACKEND='Agg',
+               PYTHONPATH=op.dirname(EVALUATION_SCRIPT))
+    command = [
+        sys.executable, '-c',
+        'import runpy, sys; sys.argv = sys.argv[1:]; '
+        'runpy.run_path(sys.argv[0], run_name="__main__")',
+        EVALUATION_SCRIPT, '--jobs', str(jobs)
+    ]
+    start = time.perf_counter()
+    subprocess.run(command, cwd=root, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def parse_size(text):
+    """Parse a dataset size given as EXCERPTSxEVENTS, e.g. 20x100"""
+    nr_excerpts, nr_events = text.lower().split('x')
+    return int(nr_excerpts), int(nr_events)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '-o', '--output', default='benchmark.json',
+        help='JSON file to write the timings to (default: benchmark.json)'
+    )
+    parser.add_argument(
+        '--sizes', type=parse_size, nargs='+', default=SIZES,
+        help='dataset sizes as EXCERPTSxEVENTS (default: 20x25 20x100 '
+             '20x400)'
+    )
+    parser.add_argument(
+        '--chord-densities', type=float, nargs='+', default=CHORD_DENSITIES,
+        help='fractions of events in chords, 0 for monophonic (default: 0 '
+             '0.5)'
+    )
+    parser.add_argument(
+        '--discrimination-rows', type=int, nargs='+',
+        default=DISCRIMINATION_ROWS,
+        help='numbers of rows of the discrimination matrices'
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=REPEAT,
+        help='number of timings of which the fastest is reported'
+    )
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='number of worker processes of the end-to-end evaluation'
+    )
+    parser.add_argument(
+        '--no-end-to-end', action='store_true',
+        help='only time the scoring functions, not evaluate_prediction.py'
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = []
+    for nr_excerpts, nr_events in args.sizes:
+        for chord_density in args.chord_densities:
+            size = {'nr_excerpts': nr_excerpts, 'nr_events': nr_events,
+                    'chord_density': chord_density}
+            print(f'Benchmarking {nr_excerpts} excerpts of {nr_events} '
+                  f'events, chord density {chord_density}')
+            with tempfile.TemporaryDirectory() as root:
+                model_dirs = generate_dataset(
+                    root, nr_excerpts, nr_events, chord_density, args.seed)
+                timings = benchmark_scores(load_excerpts(root), args.repeat)
+                if not args.no_end_to_end:
+                    timings['evaluate_prediction'] = benchmark_end_to_end(
+                        root, model_dirs, args.jobs)
+            for name, seconds in timings.items():
+                results.append(dict(size, benchmark=name, seconds=seconds))
+    for nr_rows in args.discrimination_rows:
+        print(f'Benchmarking get_scores on {nr_rows} rows')
+        results.append({
+            'benchmark': 'get_scores', 'nr_rows': nr_rows,
+            'seconds': benchmark_discrimination(nr_rows, args.seed,
+                                                args.repeat)
+        })
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'results': results
+        }, f, indent=2)
+    print(pd.DataFrame(results).to_string(index=False))
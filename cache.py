@@ -0,0 +1,148 @@
+"""Reading of directories of CSV files into corpora, with an on-disk cache
+of the parsed points so that repeated runs do not parse every CSV again."""
+import hashlib
+import io
+import os
+import os.path as op
+from glob import glob
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+from corpus import Corpus
+
+# CSV column keys in dataset
+COLNAMES = ['onset', 'pitch', 'morph', 'dur', 'ch']
+# Number of bytes read at once from the end of a file by `read_last_row`
+TAIL_BLOCK_SIZE = 4096
+
+
+def get_fn(path):
+    """Get the filename of the csv file to evaluate"""
+    return path.split('/')[-1].split('.')[0]
+
+
+def read_last_row(path, names):
+    """Read only the last (non-empty) row of a CSV file, from the end of the
+    file, as a dataframe with columns `names`; for files of which nothing
+    else is needed, such as the primes, of which only the last onset is
+    used"""
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        tail = b''
+        while True:
+            start = max(0, end - TAIL_BLOCK_SIZE)
+            f.seek(start)
+            tail = f.read(end - start) + tail
+            end = start
+            lines = tail.rstrip().split(b'\n')
+            # the last line is complete once a line break precedes it
+            if len(lines) > 1 or start == 0:
+                break
+    if not lines[-1].strip():
+        return pd.DataFrame(columns=names)
+    return pd.read_csv(io.BytesIO(lines[-1]), names=names)
+
+
+def read_csv_dir(pattern, names, preprocess=None, cache_dir=None, key=None,
+                 reader=None):
+    '''Read all CSV files matching `pattern` into a corpus of onsets and
+    pitches. If `cache_dir` is given, the parsed (and preprocessed) points are
+    stored there in one .npz file per pattern, with the path, size and
+    modification time of every file. On the next call only files which are
+    new or whose size or modification time changed are parsed again.
+
+    Parameters
+    ----------
+    pattern : str
+        Glob pattern of the CSV files
+    names : list[str]
+        The column names of the CSV files, including 'onset' and 'pitch'
+    preprocess : callable, optional
+        Function applied to every dataframe after reading it (e.g.
+        deduplication), which should return a dataframe with columns 'onset'
+        and 'pitch'. The cache is kept separately per function name.
+    cache_dir : str, optional
+        Directory to keep the cache in, by default nothing is cached
+    key : callable, optional
+        Function giving the file name of each excerpt in the corpus from its
+        path, by default the path itself
+    reader : callable, optional
+        Function reading a dataframe from the path of a file and `names`
+        (e.g. `read_last_row`), by default the whole file is read. The cache
+        is kept separately per function name.
+
+    Returns
+    -------
+    output : Corpus
+        The points of every file matching `pattern`, in glob order
+    '''
+    paths = glob(pattern)
+    stats = [os.stat(path) for path in paths]
+    cached = {}
+    cache_path = None
+    if cache_dir is not None:
+        cache_key = '|'.join((op.abspath(pattern), ','.join(names),
+                              getattr(preprocess, '__name__', ''),
+                              getattr(reader, '__name__', '')))
+        cache_path = op.join(
+            cache_dir, hashlib.sha1(cache_key.encode()).hexdigest() + '.npz')
+        cached = _load_cache(cache_path)
+    onsets, pitches = [], []
+    changed = len(cached) != len(paths)
+    for path, stat in zip(tqdm(paths), stats):
+        entry = cached.get(path)
+        if entry is not None and entry[:2] == (stat.st_size,
+                                               stat.st_mtime_ns):
+            onsets.append(entry[2])
+            pitches.append(entry[3])
+            continue
+        changed = True
+        if reader is None:
+            df = pd.read_csv(path, names=names)
+        else:
+            df = reader(path, names)
+        if preprocess is not None:
+            df = preprocess(df)
+        onsets.append(df['onset'].values)
+        pitches.append(df['pitch'].values)
+    fns = paths if key is None else [key(path) for path in paths]
+    output = Corpus.from_arrays(fns, onsets, pitches)
+    if cache_path is not None and changed:
+        _save_cache(cache_path, paths, stats, output)
+    return output
+
+
+def _load_cache(cache_path):
+    """Return the cached points as a dictionary with for every path a tuple
+    (size, modification time, onsets, pitches)"""
+    if not op.exists(cache_path):
+        return {}
+    with np.load(cache_path) as data:
+        offsets = data['offsets']
+        onsets = data['onsets']
+        pitches = data['pitches']
+        return {
+            path: (int(size), int(mtime), onsets[start:stop],
+                   pitches[start:stop])
+            for path, size, mtime, start, stop in zip(
+                data['paths'].tolist(), data['sizes'], data['mtimes'],
+                offsets[:-1], offsets[1:])
+        }
+
+
+def _save_cache(cache_path, paths, stats, corpus):
+    """Write the points of `corpus`, read from `paths`, to `cache_path`"""
+    os.makedirs(op.dirname(cache_path) or '.', exist_ok=True)
+    temp_path = cache_path + '.tmp.npz'
+    np.savez(
+        temp_path,
+        paths=np.array(paths, dtype=str),
+        sizes=np.array([stat.st_size for stat in stats], dtype=np.int64),
+        mtimes=np.array([stat.st_mtime_ns for stat in stats], dtype=np.int64),
+        offsets=corpus.offsets,
+        onsets=corpus.onsets,
+        pitches=corpus.pitches
+    )
+    os.replace(temp_path, cache_path)
@@ -0,0 +1,161 @@
+"""Compact in-memory representation of all excerpts of a directory."""
+import numpy as np
+import pandas as pd
+
+
+class Corpus(object):
+    '''The (onset, pitch) points of many excerpts, concatenated into two flat
+    arrays. The points of the excerpt in slot i are
+    `onsets[offsets[i]:offsets[i + 1]]` and
+    `pitches[offsets[i]:offsets[i + 1]]`, and `index` maps each file name to
+    its slot. Points are kept in the order in which they were read.
+
+    Parameters
+    ----------
+    fns : list[str]
+        The file names of the excerpts
+    onsets : np.ndarray
+        The onsets of all excerpts, concatenated
+    pitches : np.ndarray
+        The pitches of all excerpts, concatenated
+    offsets : np.ndarray
+        The start of every excerpt in `onsets` and `pitches`, followed by the
+        total number of points
+    '''
+    def __init__(self, fns, onsets, pitches, offsets):
+        self.fns = list(fns)
+        self.onsets = _compact(np.asarray(onsets, dtype=float),
+                               (np.float32, np.float64))
+        self.pitches = _compact(np.asarray(pitches, dtype=float),
+                                (np.int8, np.int16, np.int32, np.float32,
+                                 np.float64))
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.index = {fn: slot for slot, fn in enumerate(self.fns)}
+
+    @classmethod
+    def from_arrays(cls, fns, onsets, pitches):
+        """Build a corpus from a list of onset arrays and a list of pitch
+        arrays, one per file name"""
+        lengths = [len(values) for values in onsets]
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        return cls(
+            fns,
+            np.concatenate([np.zeros(0)] + [np.asarray(v) for v in onsets]),
+            np.concatenate([np.zeros(0)] + [np.asarray(v) for v in pitches]),
+            offsets
+        )
+
+    @classmethod
+    def from_frames(cls, frames):
+        """Build a corpus from a dictionary of dataframes with columns
+        'onset' and 'pitch'"""
+        return cls.from_arrays(
+            frames.keys(),
+            [df['onset'].values for df in frames.values()],
+            [df['pitch'].values for df in frames.values()]
+        )
+
+    def __len__(self):
+        return len(self.fns)
+
+    def __iter__(self):
+        return iter(self.fns)
+
+    def __contains__(self, fn):
+        return fn in self.index
+
+    def keys(self):
+        return list(self.fns)
+
+    def points(self, fn):
+        """The onsets and pitches of excerpt `fn`, as views into the
+        corpus"""
+        slot = self.index[fn]
+        start, stop = self.offsets[slot], self.offsets[slot + 1]
+        return self.onsets[start:stop], self.pitches[start:stop]
+
+    def __getitem__(self, fn):
+        """The points of excerpt `fn` as a dataframe with columns 'onset' and
+        'pitch'"""
+        onsets, pitches = self.points(fn)
+        return pd.DataFrame({'onset': onsets, 'pitch': pitches})
+
+
+def dedup_and_preproc(df):
+    """In order that CS works correctly, we need to ensure there are no
+    duplicate points in (onset, pitch) space. Given that score do not use
+    any other data than onset and pitch, we are safe to drop other columns
+    """
+    df = df[['onset', 'pitch']].drop_duplicates()
+    return df
+
+
+def deduplicate(corpus):
+    """Remove the duplicate (onset, pitch) points of all excerpts of a corpus
+    at once, keeping the first occurrence of every point in the order in
+    which they were read, as `dedup_and_preproc` does for one dataframe.
+
+    Every point is given one integer key packing its slot and the ranks of
+    its onset and pitch among the distinct onsets and pitches of the corpus
+    (exact, unlike onset ticks of a fixed resolution), so that one stable
+    sort of the keys finds the duplicates of all excerpts.
+    """
+    slots = np.repeat(np.arange(len(corpus)), np.diff(corpus.offsets))
+    nr_onsets, onset_ranks = _ranks(corpus.onsets)
+    nr_pitches, pitch_ranks = _ranks(corpus.pitches)
+    if len(corpus) * nr_onsets * nr_pitches < 2**63:
+        keys = [(slots * nr_onsets + onset_ranks) * nr_pitches + pitch_ranks]
+        order = np.argsort(keys[0], kind='stable')
+    else:
+        # too many distinct points to pack their keys into 64 bits
+        keys = [slots, onset_ranks, pitch_ranks]
+        order = np.lexsort(keys[::-1])
+    first = np.ones(len(order), dtype=bool)
+    if len(order):
+        first[1:] = False
+        for key in keys:
+            sorted_key = key[order]
+            first[1:] |= sorted_key[1:] != sorted_key[:-1]
+    keep = np.sort(order[first])
+    offsets = np.concatenate(
+        ([0], np.cumsum(np.bincount(slots[keep], minlength=len(corpus)))))
+    return Corpus(corpus.fns, corpus.onsets[keep], corpus.pitches[keep],
+                  offsets)
+
+
+def as_corpus(data):
+    """Return `data` if it is a corpus, or build one from a dictionary of
+    dataframes"""
+    if isinstance(data, Corpus):
+        return data
+    return Corpus.from_frames(data)
+
+
+def _ranks(values):
+    """The number of distinct values and an integer rank for every value,
+    equal for equal values; integers (such as MIDI pitches) are their own
+    ranks, offset by the smallest value, rather than being sorted"""
+    if np.issubdtype(values.dtype, np.integer):
+        if not len(values):
+            return 0, values.astype(np.int64)
+        smallest = int(values.min())
+        return (int(values.max()) - smallest + 1,
+                values.astype(np.int64) - smallest)
+    distinct, ranks = np.unique(values, return_inverse=True)
+    return len(distinct), ranks
+
+
+def _compact(values, dtypes):
+    """Cast `values` to the first of `dtypes` which represents all of them
+    exactly"""
+    for dtype in dtypes:
+        if np.issubdtype(dtype, np.integer):
+            info = np.iinfo(dtype)
+            if (len(values) and (np.any(values != np.round(values))
+                                 or values.min() < info.min
+                                 or values.max() > info.max)):
+                continue
+        converted = values.astype(dtype)
+        if np.array_equal(converted.astype(float), values):
+            return converted
+    return values
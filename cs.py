@@ -1,15 +1,36 @@
 from collections import Counter
-import re
-import os.path as op
+import time
 
+import numpy as np
 import pandas as pd
-from tqdm import tqdm
-import seaborn as sns
-import matplotlib.pyplot as plt
 
-import config
+from corpus import as_corpus
+from matching import match_model_outputs
+from parallel import map_tasks
+import profiling
 
-def evaluate_cs(original, generated):
+# Onsets are quantised to this many ticks per beat to count translation vectors
+# with NumPy; a power of two keeps the quantisation of on-grid onsets exact
+TICKS_PER_BEAT = 2 ** 12
+# Default upper bound, in bytes, of the blocks of translation vectors counted
+# at once
+MEMORY_BUDGET = 2 ** 27
+# Cost of one cell of an FFT cross-correlation (per log2 of the grid size)
+# relative to counting one translation vector, used by `method='auto'`
+FFT_COST = 2.0
+METHODS = ('auto', 'pairwise', 'fft')
+# The cutoffs at which `score_cs` evaluates continuations, in beats after the
+# end of the prime
+ONSET_INCREMENT = 0.5
+EVALUATE_FROM_ONSET = 2.0
+EVALUATE_UNTIL_ONSET = 10.0
+# Name of the cardinality scores in a `store.ResultStore`, including the
+# cutoffs so that scores at other cutoffs are not reused
+STORE_NAME = (f'cs|{ONSET_INCREMENT}|{EVALUATE_FROM_ONSET}|'
+              f'{EVALUATE_UNTIL_ONSET}')
+
+
+def evaluate_cs(original, generated, memory_budget=None, method='auto'):
     '''Given a original and generated events, calculate precision, recall, and
     F1 of the cardinality score. It is expected that `original` and `generated`
     are pandas dataframes containing columns 'onset' and 'pitch' and that they
@@ -23,6 +44,13 @@ def evaluate_cs(original, generated):
     generated : pd.DataFrame
         A dataframe containing columns 'onset' and 'pitch' representing the
         generated continuation to be evaluated
+    memory_budget : int, optional
+        The maximum number of bytes used for counting translation vectors at
+        once, defaults to `MEMORY_BUDGET`
+    method : str, optional
+        'pairwise' counts the translation vectors of all pairs of points,
+        'fft' gets them from a cross-correlation of the point sets rasterised
+        on an onset by pitch grid, and 'auto' (default) picks the cheaper one
 
     Returns
     -------
@@ -30,16 +58,235 @@ def evaluate_cs(original, generated):
         A dictionary containing three keys: 'rec', 'prec' and 'F1', the recall
         precision and the F1 of the cardinality score.
     '''
-    translation_vectors = []
+    original_vec = original[['onset', 'pitch']].values
     generated_vec = generated[['onset', 'pitch']].values
-    original_list = original[['onset', 'pitch']].values.tolist()
-    for point in original_list:
+    grid = _grid_points(original_vec, generated_vec)
+    method = _select_method(method, grid, len(original_vec),
+                            len(generated_vec), memory_budget)
+    if method == 'fft':
+        count = _fft_max_count(grid, len(original_vec), len(original_vec),
+                               len(generated_vec))
+    else:
+        histogram = _VectorHistogram(
+            original_vec, generated_vec, grid, memory_budget)
+        histogram.add(0, len(original_vec), 0, len(generated_vec))
+        count = histogram.max_count
+    return _scores_from_count(count, len(original), len(generated))
+
+
+class _VectorHistogram(object):
+    """Running histogram of the translation vectors from points of
+    `original_vec` to points of `generated_vec` (arrays of (onset, pitch)
+    rows). Vectors are added for blocks of rows with `add`, and the count of
+    the most common vector so far is kept in `max_count`.
+
+    If all onsets and pitches land on an integer grid of `TICKS_PER_BEAT`
+    ticks per beat (`grid`, as returned by `_grid_points`), each point is
+    packed into a single int64 so that the difference of two packed points
+    identifies the translation vector, and counting is done with NumPy in
+    blocks of at most `memory_budget` bytes.
+    As the grid resolution is a power of two, float differences of on-grid
+    onsets are exact, so the counts are identical to counting the float
+    vectors. Off-grid points fall back to counting tuples of floats.
+    """
+    def __init__(self, original_vec, generated_vec, grid,
+                 memory_budget=None):
+        self.original_vec = original_vec
+        self.generated_vec = generated_vec
+        self.memory_budget = memory_budget or MEMORY_BUDGET
+        self.max_count = 0
+        # observed vectors if the histogram is sparse, None if it is dense
+        self.keys = None
+        packed = _pack_points(grid, len(original_vec))
+        if packed is None:
+            self.counts = Counter()
+            return
+        self.original_keys, self.generated_keys, self.nr_keys = packed
+        if self.nr_keys * 8 <= self.memory_budget:
+            self.counts = np.zeros(self.nr_keys, dtype=np.int64)
+        else:
+            # too many possible vectors for a dense histogram: keep the
+            # sorted observed vectors with their counts instead
+            self.keys = np.zeros(0, dtype=np.int64)
+            self.counts = np.zeros(0, dtype=np.int64)
+
+    def add(self, original_start, original_stop, generated_start,
+            generated_stop):
+        """Add the translation vectors from original rows
+        [original_start, original_stop) to generated rows
+        [generated_start, generated_stop)"""
+        width = generated_stop - generated_start
+        if original_stop <= original_start or width <= 0:
+            return
+        if isinstance(self.counts, Counter):
+            block_counts = _count_vectors(
+                self.original_vec[original_start:original_stop],
+                self.generated_vec[generated_start:generated_stop]
+            )
+            for vector, count in block_counts.items():
+                self.counts[vector] += count
+                self.max_count = max(self.max_count, self.counts[vector])
+            return
+        generated_keys = self.generated_keys[generated_start:generated_stop]
+        chunk_rows = max(1, self.memory_budget // (8 * width))
+        for start in range(original_start, original_stop, chunk_rows):
+            stop = min(start + chunk_rows, original_stop)
+            keys = (generated_keys[np.newaxis, :]
+                    - self.original_keys[start:stop, np.newaxis]).ravel()
+            self._add_keys(keys)
+
+    def _add_keys(self, keys):
+        if self.keys is None:
+            if self.nr_keys <= len(keys):
+                self.counts += np.bincount(keys, minlength=self.nr_keys)
+                self.max_count = max(self.max_count, int(self.counts.max()))
+            else:
+                unique, counts = np.unique(keys, return_counts=True)
+                self.counts[unique] += counts
+                self.max_count = max(
+                    self.max_count, int(self.counts[unique].max()))
+            return
+        unique, inverse = np.unique(
+            np.concatenate((self.keys, keys)), return_inverse=True)
+        weights = np.concatenate(
+            (self.counts, np.ones(len(keys), dtype=np.int64)))
+        self.keys = unique
+        self.counts = np.bincount(
+            inverse, weights=weights, minlength=len(unique)
+        ).astype(np.int64)
+        self.max_count = max(self.max_count, int(self.counts.max()))
+
+
+def _grid_points(original_vec, generated_vec):
+    """Quantise the points of both sets to integer (onset tick, pitch)
+    coordinates, starting at zero, on the coarsest grid of `TICKS_PER_BEAT`
+    ticks per beat that all onsets lie on.
+
+    Returns
+    -------
+    output : tuple or None
+        The ticks and the pitches of the original points followed by the
+        generated points, as int64 arrays; or None if some points do not land
+        exactly on the grid
+    """
+    points = np.concatenate((original_vec, generated_vec)).astype(float)
+    if len(points) == 0:
+        return None
+    ticks = points[:, 0] * TICKS_PER_BEAT
+    pitches = points[:, 1]
+    on_grid = (np.all(np.abs(ticks) < 2 ** 52)
+               and np.all(np.abs(pitches) < 2 ** 31)
+               and np.all(ticks == np.round(ticks))
+               and np.all(pitches == np.round(pitches)))
+    if not on_grid:
+        return None
+    ticks = ticks.astype(np.int64)
+    ticks -= ticks.min()
+    # only differences matter, so use the coarsest grid the onsets lie on
+    step = np.gcd.reduce(ticks)
+    if step > 1:
+        ticks //= step
+    pitches = pitches.astype(np.int64)
+    pitches -= pitches.min()
+    return ticks, pitches
+
+
+def _pack_points(grid, nr_original):
+    """Pack every point of `grid` into one int64, such that `generated -
+    original + offset` is a unique, non-negative key for each translation
+    vector.
+
+    Returns
+    -------
+    output : tuple or None
+        The packed original points, the packed generated points shifted by
+        the offset, and the number of possible keys; or None if the points are
+        off-grid or the keys would overflow
+    """
+    if grid is None:
+        return None
+    ticks, pitches = grid
+    max_tick, max_pitch = int(ticks.max()), int(pitches.max())
+    pitch_span = 2 * max_pitch + 1
+    nr_keys = (2 * max_tick + 1) * pitch_span
+    if nr_keys >= 2 ** 62:
+        return None
+    packed = ticks * pitch_span + pitches
+    offset = max_tick * pitch_span + max_pitch
+    return packed[:nr_original], packed[nr_original:] + offset, nr_keys
+
+
+def _fft_shape(ticks, pitches):
+    """The shape of the FFT needed for a linear cross-correlation of point
+    sets rasterised on a grid holding all `ticks` and `pitches`"""
+    return tuple(
+        1 << int(2 * (int(coords.max()) + 1) - 2).bit_length()
+        for coords in (ticks, pitches)
+    )
+
+
+def _fft_max_count(grid, nr_original, original_stop, generated_stop):
+    """Count the most common translation vector from the first
+    `original_stop` original points to the first `generated_stop` generated
+    points of `grid`, by cross-correlating both point sets rasterised on a
+    binary onset by pitch grid"""
+    ticks, pitches = grid
+    selection = np.r_[0:original_stop,
+                      nr_original:nr_original + generated_stop]
+    ticks, pitches = ticks[selection], pitches[selection]
+    shape = (int(ticks.max()) + 1, int(pitches.max()) + 1)
+    fft_shape = _fft_shape(ticks, pitches)
+    spectra = []
+    for start, stop in ((0, original_stop), (original_stop, len(ticks))):
+        raster = np.bincount(
+            ticks[start:stop] * shape[1] + pitches[start:stop],
+            minlength=shape[0] * shape[1]
+        ).reshape(shape).astype(float)
+        spectra.append(np.fft.rfft2(raster, fft_shape))
+    correlation = np.fft.irfft2(np.conj(spectra[0]) * spectra[1], fft_shape)
+    return int(np.round(correlation.max()))
+
+
+def _select_method(method, grid, nr_original, nr_generated,
+                   memory_budget=None, nr_evaluations=1):
+    """Resolve `method` to 'pairwise' or 'fft', choosing the cheaper one for
+    'auto' by comparing the number of translation vectors with the (padded)
+    size of the grid, which has to be correlated `nr_evaluations` times"""
+    if method not in METHODS:
+        raise ValueError(
+            f'Unknown method {method!r}, expected one of {METHODS}')
+    if method == 'fft' and grid is None:
+        raise ValueError('The fft method requires points on the onset grid')
+    if method != 'auto':
+        return method
+    if grid is None:
+        return 'pairwise'
+    grid_size = np.prod(_fft_shape(*grid))
+    # three complex grids are held in memory at once
+    if grid_size * 16 * 3 > (memory_budget or MEMORY_BUDGET):
+        return 'pairwise'
+    fft_cost = (FFT_COST * nr_evaluations * grid_size
+                * np.log2(max(grid_size, 2)))
+    if fft_cost < nr_original * nr_generated:
+        return 'fft'
+    return 'pairwise'
+
+
+def _count_vectors(original_vec, generated_vec):
+    """Count the translation vectors from every point in `original_vec` to
+    every point in `generated_vec` (arrays of (onset, pitch) rows)"""
+    translation_vectors = []
+    for point in original_vec.tolist():
         vectors = generated_vec - point
         translation_vectors.extend([tuple(v) for v in vectors])
-    vector_counts = Counter(translation_vectors)
-    most_common_vector, count = vector_counts.most_common(1)[0]
-    recall = (count - 1) / float(len(original) - 1)
-    precision = (count - 1) / float(len(generated) - 1)
+    return Counter(translation_vectors)
+
+
+def _scores_from_count(count, nr_original, nr_generated):
+    """Turn the count of the most common translation vector into recall,
+    precision and F1 of the cardinality score"""
+    recall = (count - 1) / float(nr_original - 1)
+    precision = (count - 1) / float(nr_generated - 1)
     if precision + recall == 0:
         f1 = 0.0
     else:
@@ -52,7 +299,8 @@ def evaluate_cs(original, generated):
 
 def evaluate_continuation(original, generated, last_onset_prime,
                           onset_increment, evaluate_from_onset,
-                          evaluate_until_onset):
+                          evaluate_until_onset, memory_budget=None,
+                          method='auto'):
     """Given the original and the generated continuations, get the cardinality
     score at different increments through time.
 
@@ -74,6 +322,11 @@ def evaluate_continuation(original, generated, last_onset_prime,
     evaluate_until_onset : float
         The maximum number of onsets after `last_onset_prime` to evaluate the
         continuation to
+    memory_budget : int, optional
+        The maximum number of bytes used for counting translation vectors at
+        once, defaults to `MEMORY_BUDGET`
+    method : str, optional
+        The method to count translation vectors with, see `evaluate_cs`
 
     Returns
     -------
@@ -83,7 +336,225 @@ def evaluate_continuation(original, generated, last_onset_prime,
         - 'measure' (prec / rec / F1)
         - 'value' for the onset / measure pair
     """
+    scores = continuation_scores(
+        original[['onset', 'pitch']].values,
+        generated[['onset', 'pitch']].values,
+        last_onset_prime, onset_increment, evaluate_from_onset,
+        evaluate_until_onset, memory_budget, method
+    )
+    return pd.DataFrame(scores)
+
+
+def continuation_scores(original_vec, generated_vec, last_onset_prime,
+                        onset_increment, evaluate_from_onset,
+                        evaluate_until_onset, memory_budget=None,
+                        method='auto'):
+    """Array version of `evaluate_continuation`: `original_vec` and
+    `generated_vec` are arrays of (onset, pitch) rows, and the scores are
+    returned as a dictionary of lists with keys 'Onset', 'Precision', 'Recall'
+    and 'F1'.
+    """
+    return continuation_scores_models(
+        original_vec, [generated_vec], last_onset_prime, onset_increment,
+        evaluate_from_onset, evaluate_until_onset, memory_budget, method)[0]
+
+
+def continuation_scores_models(original_vec, generated_vecs,
+                               last_onset_prime, onset_increment,
+                               evaluate_from_onset, evaluate_until_onset,
+                               memory_budget=None, method='auto',
+                               timings=None):
+    """`continuation_scores` of several generated continuations (e.g. the
+    outputs of all models) against the same original continuation, which is
+    sorted and split at the cutoffs only once. Returns a list with the scores
+    of every generated continuation. If `timings` is a list, the wall and CPU
+    time of scoring every generated continuation (without the shared
+    preparation) are appended to it."""
+    # Each cutoff only adds points to the previous prefix, so sort both
+    # continuations by onset once and keep a running histogram of translation
+    # vectors, adding only the vectors of the newly included points.
+    original_vec = _sort_by_onset(original_vec)
+    cutoffs = list(evaluation_cutoffs(
+        last_onset_prime, onset_increment, evaluate_from_onset,
+        evaluate_until_onset))
+    if cutoffs:
+        # points beyond the last cutoff are never scored
+        original_vec = original_vec[:np.searchsorted(
+            original_vec[:, 0], cutoffs[-1][1], side='right')]
+    # Select all rows with onset times less than or equal to each cutoff
+    original_stops = np.searchsorted(
+        original_vec[:, 0], [cutoff for onset, cutoff in cutoffs],
+        side='right')
+    scores = []
+    for generated_vec in generated_vecs:
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        scores.append(_prefix_scores(original_vec, original_stops,
+                                     generated_vec, cutoffs, memory_budget,
+                                     method))
+        if timings is not None:
+            timings.append((time.perf_counter() - start_wall,
+                            time.process_time() - start_cpu))
+    return scores
+
+
+def _prefix_scores(original_vec, original_stops, generated_vec, cutoffs,
+                   memory_budget, method):
+    """The scores of `continuation_scores` for one generated continuation,
+    given the sorted original continuation and its number of points up to
+    each cutoff"""
     scores = {'Onset': [], 'Precision': [], 'Recall': [], 'F1': []}
+    generated_vec = _sort_by_onset(generated_vec)
+    if cutoffs:
+        generated_vec = generated_vec[:np.searchsorted(
+            generated_vec[:, 0], cutoffs[-1][1], side='right')]
+    generated_stops = np.searchsorted(
+        generated_vec[:, 0], [cutoff for onset, cutoff in cutoffs],
+        side='right')
+    grid = _grid_points(original_vec, generated_vec)
+    method = _select_method(method, grid, len(original_vec),
+                            len(generated_vec), memory_budget, len(cutoffs))
+    histogram = None
+    if method == 'pairwise':
+        histogram = _VectorHistogram(
+            original_vec, generated_vec, grid, memory_budget)
+    nr_original = nr_generated = 0
+    for (onset, cutoff), new_original, new_generated in zip(
+            cutoffs, original_stops, generated_stops):
+        scores['Onset'].append(onset)
+        if histogram is not None:
+            # new original points against all generated points up to the
+            # cutoff, and old original points against the new generated points
+            histogram.add(nr_original, new_original, 0, new_generated)
+            histogram.add(0, nr_original, nr_generated, new_generated)
+        nr_original, nr_generated = new_original, new_generated
+        if nr_original <= 1 or nr_generated <= 1:
+            scores['Precision'].append(None)
+            scores['Recall'].append(None)
+            scores['F1'].append(None)
+            continue
+        if histogram is not None:
+            count = histogram.max_count
+        else:
+            count = _fft_max_count(
+                grid, len(original_vec), nr_original, nr_generated)
+        output = _scores_from_count(count, nr_original, nr_generated)
+        scores['Precision'].append(output['prec'])
+        scores['Recall'].append(output['rec'])
+        scores['F1'].append(output['F1'])
+    return scores
+
+
+class OnlineContinuationScore(object):
+    '''Cardinality scores at every cutoff of a continuation that is generated
+    one event at a time. Rather than rescoring the whole continuation, each
+    new event only adds its translation vectors to the original points,
+    O(m) work for m original points (times the number of cutoffs).
+
+    Parameters
+    ----------
+    original_vec : np.ndarray
+        The true continuation as (onset, pitch) rows, e.g.
+        ``original[['onset', 'pitch']].values``
+    last_onset_prime : float
+        The onset time of the last onset of the prime
+    onset_increment, evaluate_from_onset, evaluate_until_onset : float
+        The cutoffs, see `evaluate_continuation`; by default those of
+        `score_cs`
+    '''
+    def __init__(self, original_vec, last_onset_prime,
+                 onset_increment=ONSET_INCREMENT,
+                 evaluate_from_onset=EVALUATE_FROM_ONSET,
+                 evaluate_until_onset=EVALUATE_UNTIL_ONSET):
+        cutoffs = list(evaluation_cutoffs(
+            last_onset_prime, onset_increment, evaluate_from_onset,
+            evaluate_until_onset))
+        self.onsets = [onset for onset, cutoff in cutoffs]
+        self.cutoffs = np.array([cutoff for onset, cutoff in cutoffs])
+        original_vec = np.unique(
+            np.asarray(original_vec, dtype=float).reshape(-1, 2), axis=0)
+        steps = self._steps(original_vec[:, 0])
+        # original points beyond the last cutoff are never scored
+        self.original_vec = original_vec[steps < len(self.cutoffs)]
+        self.original_steps = steps[steps < len(self.cutoffs)]
+        self.nr_original = np.cumsum(np.bincount(
+            self.original_steps, minlength=len(self.cutoffs)))
+        self.nr_generated = np.zeros(len(self.cutoffs), dtype=np.int64)
+        self.max_counts = np.zeros(len(self.cutoffs), dtype=np.int64)
+        self.generated = set()
+        # cumulative counts per cutoff of every translation vector seen, one
+        # row per vector
+        self.vectors = {}
+        self.counts = np.zeros((16, len(self.cutoffs)), dtype=np.int64)
+
+    def _steps(self, onsets):
+        """The index of the first cutoff at or after each onset"""
+        return np.searchsorted(self.cutoffs, onsets, side='left')
+
+    def add(self, onset, pitch):
+        """Add a generated event; duplicates of earlier events and events
+        beyond the last cutoff are ignored"""
+        event = (float(onset), float(pitch))
+        step = int(self._steps(event[0]))
+        if step >= len(self.cutoffs) or event in self.generated:
+            return
+        self.generated.add(event)
+        self.nr_generated[step:] += 1
+        if len(self.original_vec) == 0:
+            return
+        vectors = np.array(event) - self.original_vec
+        rows = np.array([
+            self.vectors.setdefault(vector, len(self.vectors))
+            for vector in map(tuple, vectors.tolist())
+        ])
+        if len(self.vectors) > len(self.counts):
+            grown = np.zeros((2 * len(self.vectors), len(self.cutoffs)),
+                             dtype=np.int64)
+            grown[:len(self.counts)] = self.counts
+            self.counts = grown
+        # a pair counts from the cutoff that includes both of its points
+        first_steps = np.maximum(self.original_steps, step)
+        included = np.arange(len(self.cutoffs)) >= first_steps[:, np.newaxis]
+        # the original points are distinct, so are the vectors of an event
+        self.counts[rows] += included
+        np.maximum(self.max_counts, self.counts[rows].max(axis=0),
+                   out=self.max_counts)
+
+    def add_events(self, generated_vec):
+        """Add generated events given as (onset, pitch) rows"""
+        for onset, pitch in np.asarray(generated_vec).reshape(-1, 2):
+            self.add(onset, pitch)
+
+    def scores(self):
+        """The scores of the events added so far at every cutoff, as a
+        dictionary of lists like `continuation_scores`"""
+        scores = {'Onset': [], 'Precision': [], 'Recall': [], 'F1': []}
+        for i, onset in enumerate(self.onsets):
+            scores['Onset'].append(onset)
+            nr_original = int(self.nr_original[i])
+            nr_generated = int(self.nr_generated[i])
+            if nr_original <= 1 or nr_generated <= 1:
+                scores['Precision'].append(None)
+                scores['Recall'].append(None)
+                scores['F1'].append(None)
+                continue
+            output = _scores_from_count(
+                int(self.max_counts[i]), nr_original, nr_generated)
+            scores['Precision'].append(output['prec'])
+            scores['Recall'].append(output['rec'])
+            scores['F1'].append(output['F1'])
+        return scores
+
+
+def _sort_by_onset(points):
+    """Return the (onset, pitch) rows of `points` stably sorted by onset"""
+    order = np.argsort(points[:, 0], kind='mergesort')
+    return points[order]
+
+
+def evaluation_cutoffs(last_onset_prime, onset_increment, evaluate_from_onset,
+                       evaluate_until_onset):
+    """Yield the (onset, cutoff) pairs at which a continuation is evaluated,
+    where onset is relative to the end of the prime and cutoff is absolute"""
     nr_steps = int((evaluate_until_onset - evaluate_from_onset)
                    / onset_increment)
     max_onset = evaluate_until_onset + last_onset_prime
@@ -91,72 +562,62 @@ def evaluate_continuation(original, generated, last_onset_prime,
         onset = step * onset_increment + evaluate_from_onset
         cutoff = last_onset_prime + onset
         if cutoff <= max_onset:
-            scores['Onset'].append(onset)
-            # Select all rows with onset times less than or equal to cutoff
-            original_events = original[original['onset'] <= cutoff]
-            generated_events = generated[generated['onset'] <= cutoff]
-            if (len(original_events) <= 1 or len(generated_events) <= 1):
-                scores['Precision'].append(None)
-                scores['Recall'].append(None)
-                scores['F1'].append(None)
-                continue
-            else:
-                output = evaluate_cs(original_events, generated_events)
-                scores['Precision'].append(output['prec'])
-                scores['Recall'].append(output['rec'])
-                scores['F1'].append(output['F1'])
-    return pd.DataFrame(scores)
+            yield onset, cutoff
+
+
+def _score_cs_task(task):
+    """Score one excerpt in a worker process, from the onsets and pitches of
+    the true and generated continuations and the last onset of the prime"""
+    (true_onsets, true_pitches, gen_onsets, gen_pitches,
+     prime_final_onset) = task
+    return continuation_scores(
+        np.column_stack((true_onsets, true_pitches)).astype(float),
+        np.column_stack((gen_onsets, gen_pitches)).astype(float),
+        prime_final_onset,
+        ONSET_INCREMENT, EVALUATE_FROM_ONSET, EVALUATE_UNTIL_ONSET
+    )
 
 
-def score_cs(fn_list, alg_names, files_dict, cont_true, prime):
+def score_cs(fn_list, alg_names, files_dict, cont_true, prime, n_jobs=1,
+             chunksize=None, matches=None, store=None, plot=True):
+    cont_true = as_corpus(cont_true)
+    prime = as_corpus(prime)
+    files_dict = {alg: as_corpus(files_dict[alg]) for alg in alg_names}
     card_scores = []
+    if matches is None:
+        matches = match_model_outputs(fn_list, files_dict, alg_names)
     for alg in alg_names:
         print(f'Scoring {alg} with cardinality score')
-        for fn in tqdm(fn_list):
-            # the generated file name may have additions to original file name
-            generated_fn = next(
-                (alg_fn for alg_fn in files_dict[alg].keys()
-                 if re.search(fn, alg_fn)),
-                None
-            )
-            true_df = cont_true[fn]
-            gen_df = files_dict[alg][generated_fn]
-            prime_final_onset = prime[fn].iloc[-1]['onset']
-            cs_score = evaluate_continuation(
-                true_df,
-                gen_df,
-                prime_final_onset,
-                0.5, 2.0, 10.0
-            )
+        with profiling.stage('cs', alg):
+            tasks = []
+            for fn in fn_list:
+                # the generated file name may have additions to original
+                # file name
+                generated_fn = matches[alg][fn]
+                prime_final_onset = float(prime.points(fn)[0][-1])
+                tasks.append(
+                    cont_true.points(fn)
+                    + files_dict[alg].points(generated_fn)
+                    + (prime_final_onset,)
+                )
+            if store is None:
+                results = map_tasks(
+                    _score_cs_task, tasks, n_jobs, chunksize, fn_list)
+            else:
+                results = store.map_tasks(
+                    _score_cs_task, tasks, STORE_NAME, n_jobs, chunksize,
+                    fn_list)
+        for fn, scores in zip(fn_list, results):
+            cs_score = pd.DataFrame(scores)
             cs_score['fn'] = fn
             cs_score['Model'] = alg
             card_scores.append(cs_score)
     card_df = pd.concat(card_scores, axis=0)
-    data = card_df.melt(
-        id_vars=['fn', 'Onset', 'Model'], 
-        value_vars=['Precision', 'Recall', 'F1'], 
-        var_name="measure",
-        value_name="Score"
-    )
-    plt.figure()
-    sns.set_style("whitegrid")
-    g = sns.FacetGrid(
-        data,
-        col='measure',
-        hue='Model',
-        hue_order=config.MODEL_DIRS.keys(),
-        hue_kws={
-            'marker': ['o', 'v', 's', 'D'],
-            'linestyle' : [":","--","-", "-."]
-        }
-        )
-    g = g.map(
-        sns.lineplot,
-        'Onset',
-        'Score',
-        # style='Model',
-        # style_order=config.MODEL_DIRS.keys(),
-        # markers=['o', 'v', 's']
-    ).add_legend()
-    filename = op.join(config.OUTPUT_FOLDER, '{}_cs_scores.png'.format(config.FILENAME_FRAGMENT))
-    plt.savefig(filename, dpi=300)
\ No newline at end of file
+    # the figures and tables need the config file, and the figures the
+    # plotting libraries, which the scores themselves do not
+    from report import plot_cs, write_cs_table
+    if plot:
+        with profiling.stage('plot cs'):
+            plot_cs(card_df)
+    write_cs_table(card_df)
+    return card_df
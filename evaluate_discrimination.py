@@ -19,65 +19,373 @@ continuation scores.
 N.B. It is assumed that the rows sum to 1, with the values representing the
 probability of each excerpt being the true continuation.
 """
+import argparse
+from itertools import combinations
 import os.path as op
+import warnings
 
 import numpy as np
 import pandas as pd
 
-import config
-    
+from significance import N_RESAMPLES, bootstrap_ci, permutation_tests
+
+# Number of rows of a discrimination file that are read at once
+CHUNKSIZE = 100000
+# Probabilities are clipped to this value before taking the log, so that a
+# zero probability for the true continuation gives a finite log likelihood
+EPSILON = 1e-15
+# Number of example ids listed in the warnings of `align_files`
+NR_EXAMPLE_IDS = 5
+
 
 def get_scores(x, labels=None):
-    """Returns the required scores: accuracy, mean negative log likelihood (the
-    crossentropy), and the variance of the negative log likelihood. If labels
-    is not supplied (a list of indices indicating the true label for each row),
-    it is assumed the final column of each row is the true label (this is very
-    specific to our particular expected input!)"""
+    """Returns the required scores: number of observations, accuracy, mean and
+    variance of the probability of the true label, and mean negative log
+    likelihood (the crossentropy) and the variance of the negative log
+    likelihood. If labels is not supplied (a list of indices indicating the
+    true label for each row), it is assumed the final column of each row is
+    the true label (this is very specific to our particular expected
+    input!)"""
+    return _finalise_stats(_get_stats(x, labels))
+
+
+def score_file(fn, chunksize=CHUNKSIZE, positions=None, out=None):
+    """Returns the scores of `get_scores` for a discrimination file, which is
+    read `chunksize` rows at a time with running means and variances, so
+    that memory use does not grow with the size of the file.
+
+    With `positions` (for every row of the file its position among the
+    aligned rows, or -1, as returned by `align_files`), only the aligned rows
+    are scored. With `out` (three arrays with one value per aligned row), the
+    probability and the negative log likelihood of the true label of every
+    aligned row, and whether it was classified correctly, are written to it,
+    as returned by `row_scores`."""
+    stats = None
+    start = 0
+    for df in pd.read_csv(fn, chunksize=chunksize):
+        x = df.iloc[:, 1:].values
+        if positions is not None:
+            chunk_positions = positions[start:start + len(df)]
+            start += len(df)
+            x = x[chunk_positions >= 0]
+            chunk_positions = chunk_positions[chunk_positions >= 0]
+        x = normalise_rows(x)
+        chunk_stats = _get_stats(x)
+        if out is not None:
+            for values, chunk_values in zip(out, row_scores(x)):
+                values[chunk_positions] = chunk_values
+        if stats is None:
+            stats = chunk_stats
+        else:
+            stats = _merge_stats(stats, chunk_stats)
+    return _finalise_stats(stats)
+
+
+def normalise_rows(x):
+    """Normalise the rows of `x` to sum to 1, unless they all do already"""
+    if not np.allclose(np.sum(x, axis=1), np.ones(x.shape[0])):
+        row_sums = x.sum(axis=1)
+        x = x / row_sums[:, np.newaxis]
+    return x
+
+
+def _get_stats(x, labels=None):
+    """Sufficient statistics for the scores of the rows of `x`: the number of
+    rows, the number of correctly classified rows, and the mean and the sum of
+    squared deviations of both the probability and the negative log
+    likelihood of the true label"""
     nr_obs = x.shape[0]
     nr_cols = x.shape[1]
     max_idx = nr_cols - 1
     if labels is None:
         labels = max_idx * np.ones(nr_obs, dtype=int)
-    accuracy = np.mean(np.argmax(x, axis=-1) == labels)
-    avg_prob = np.mean(x[:, labels])
-    var_prob = np.var(x[:, labels])
-    return nr_obs, accuracy, avg_prob, var_prob
+    # one probability per row, rather than all rows for every label
+    probs = x[np.arange(nr_obs), labels]
+    nll = -np.log(np.clip(probs, EPSILON, None))
+    nr_correct = np.sum(np.argmax(x, axis=-1) == labels)
+    return nr_obs, nr_correct, _moments(probs), _moments(nll)
+
+
+def _moments(values):
+    """The mean and the sum of squared deviations from the mean"""
+    if len(values) == 0:
+        return 0.0, 0.0
+    mean = np.mean(values)
+    return mean, np.sum((values - mean) ** 2)
+
+
+def _merge_stats(stats_a, stats_b):
+    """Combine the statistics of two sets of rows"""
+    nr_a, correct_a = stats_a[:2]
+    nr_b, correct_b = stats_b[:2]
+    nr_obs = nr_a + nr_b
+    moments = []
+    for (mean_a, m2_a), (mean_b, m2_b) in zip(stats_a[2:], stats_b[2:]):
+        if nr_obs == 0:
+            moments.append((0.0, 0.0))
+            continue
+        delta = mean_b - mean_a
+        moments.append((
+            mean_a + delta * nr_b / nr_obs,
+            m2_a + m2_b + delta ** 2 * nr_a * nr_b / nr_obs
+        ))
+    return (nr_obs, correct_a + correct_b) + tuple(moments)
+
+
+def _finalise_stats(stats):
+    """Turn statistics into the tuple of scores returned by `get_scores`"""
+    nr_obs, nr_correct, (avg_prob, m2_prob), (avg_nll, m2_nll) = stats
+    return (nr_obs, nr_correct / nr_obs, avg_prob, m2_prob / nr_obs,
+            avg_nll, m2_nll / nr_obs)
+
+
+def align_files(files):
+    """Align the rows of the discrimination files of several models on the
+    `id` column, reading only the ids.
+
+    The ids of all files are hashed together in one pass, and only the ids
+    present in every file are kept, in the order of the first file. A warning
+    lists the ids missing from a file (present in another file) and the ids
+    of a file that are not in all other files. The ids of all files are kept
+    in memory, but not their probabilities, which `score_file` reads in
+    chunks.
+
+    Parameters
+    ----------
+    files : dict
+        The discrimination file of every model
+
+    Returns
+    -------
+    ids : np.ndarray
+        The ids of the aligned rows
+    positions : list[np.ndarray]
+        For every model, the position of every row of its file among the
+        aligned rows, or -1 for the rows which are not scored
+    report : pd.DataFrame
+        For every model, the number of rows of its file, and the number of
+        missing, extra and duplicated ids
+    """
+    names = list(files)
+    nr_cols = {name: pd.read_csv(files[name], nrows=0).shape[1]
+               for name in names}
+    if len(set(nr_cols.values())) > 1:
+        raise ValueError(
+            'The discrimination files do not have the same number of '
+            f'columns: {nr_cols}'
+        )
+    file_ids = [pd.read_csv(files[name], usecols=[0]).iloc[:, 0].values
+                for name in names]
+    lengths = [len(values) for values in file_ids]
+    codes, uniques = pd.factorize(np.concatenate(file_ids))
+    del file_ids
+    # the row of every id in every file (the first one if it is duplicated)
+    rows = np.full((len(names), len(uniques)), -1)
+    nr_duplicated = []
+    file_codes = np.split(codes, np.cumsum(lengths)[:-1])
+    for i, model_codes in enumerate(file_codes):
+        rows[i, model_codes[::-1]] = np.arange(len(model_codes))[::-1]
+        nr_duplicated.append(len(model_codes) - len(np.unique(model_codes)))
+    present = rows >= 0
+    common = present.all(axis=0)
+    report = pd.DataFrame({
+        'nr_rows': lengths,
+        'missing': (~present).sum(axis=1),
+        'extra': (present & ~common).sum(axis=1),
+        'duplicated': nr_duplicated
+    }, index=pd.Index(names, name='model'))
+    for i, name in enumerate(names):
+        for problem, mask in (
+                (f'missing from the file of {name}', ~present[i]),
+                (f'of the file of {name} missing from other files',
+                 present[i] & ~common)):
+            if mask.any():
+                examples = ', '.join(
+                    str(id_) for id_ in uniques[mask][:NR_EXAMPLE_IDS])
+                warnings.warn(
+                    f'{mask.sum()} ids {problem}, which are not scored: '
+                    f'{examples}'
+                )
+        if nr_duplicated[i]:
+            warnings.warn(
+                f'{nr_duplicated[i]} duplicated ids in the file of {name}, '
+                'using their first row'
+            )
+    # the position of every id among the aligned ids
+    aligned = np.full(len(uniques), -1)
+    aligned[common] = np.arange(common.sum())
+    positions = []
+    for i, length in enumerate(lengths):
+        model_positions = np.full(length, -1)
+        model_positions[rows[i, common]] = aligned[common]
+        positions.append(model_positions)
+    return np.asarray(uniques[common]), positions, report
+
+
+def row_scores(x, labels=None):
+    """The per-row scores of the rows of `x`: the probability and the
+    negative log likelihood of the true label, and whether it was classified
+    correctly. See `get_scores` for `labels`."""
+    nr_obs, nr_cols = x.shape
+    if labels is None:
+        labels = (nr_cols - 1) * np.ones(nr_obs, dtype=int)
+    probs = x[np.arange(nr_obs), labels]
+    nll = -np.log(np.clip(probs, EPSILON, None))
+    correct = np.argmax(x, axis=-1) == labels
+    return probs, nll, correct
+
+
+def score_aligned(files, ids, positions, chunksize=CHUNKSIZE,
+                  keep_rows=True):
+    """Score the aligned rows of the files of several models, with the ids
+    and positions returned by `align_files`, reading each file in chunks with
+    `score_file`.
+
+    Returns the scores of `get_scores` of every model, in an array with one
+    row per model, and (if `keep_rows`) the per-row scores of `row_scores`
+    of all models, three arrays of shape (models, aligned rows) needed by
+    `confidence_intervals` and `paired_comparisons`. These take memory in
+    proportion to the number of rows, unlike the scores themselves."""
+    out = None
+    if keep_rows:
+        out = (np.empty((len(files), len(ids))),
+               np.empty((len(files), len(ids))),
+               np.zeros((len(files), len(ids)), dtype=bool))
+    scores = np.array([
+        score_file(fn, chunksize, model_positions,
+                   None if out is None else [values[i] for values in out])
+        for i, (fn, model_positions) in enumerate(zip(files.values(),
+                                                      positions))
+    ])
+    return scores, out
+
+
+def confidence_intervals(probs, nll, correct, n_boot=N_RESAMPLES):
+    """Bootstrapped confidence intervals of the accuracy, the mean
+    probability and the mean negative log likelihood of the true label, from
+    the per-row scores of several models returned by `score_aligned` (see
+    `significance.bootstrap_ci`); returns a table with one row per model"""
+    bounds = bootstrap_ci(np.concatenate((correct, probs, nll)), n_boot)
+    intervals = {}
+    for i, score in enumerate(['accuracy', 'mean_probability', 'mean_nll']):
+        model_bounds = bounds[i * len(probs):(i + 1) * len(probs)]
+        intervals[f'{score}_ci_low'] = model_bounds[:, 0]
+        intervals[f'{score}_ci_high'] = model_bounds[:, 1]
+    return pd.DataFrame(intervals)
+
+
+def paired_comparisons(probs, nll, correct, names, n_perm=N_RESAMPLES):
+    """Compare every pair of models on the same (aligned) rows.
+
+    Parameters
+    ----------
+    probs, nll, correct : np.ndarray
+        The per-row scores of the models, as returned by `score_aligned`
+    names : list[str]
+        The models, in the order of the per-row scores
+    n_perm : int, optional
+        The number of permutations of the tests of the differences
+
+    Returns
+    -------
+    comparisons : pd.DataFrame
+        For every pair of models A and B, the number of rows, the difference
+        in accuracy and in mean negative log likelihood (A minus B) and the
+        p-values of paired permutation tests of these differences (see
+        `significance.permutation_tests`), the proportion of rows where A
+        gives the true label a higher probability than B, and the number of
+        rows only classified correctly by A and by B
+    """
+    pairs = list(combinations(range(len(names)), 2))
+    p_accuracy = permutation_tests(
+        [correct[a].astype(float) - correct[b] for a, b in pairs], n_perm)
+    p_nll = permutation_tests([nll[a] - nll[b] for a, b in pairs], n_perm)
+    comparisons = []
+    for i, (a, b) in enumerate(pairs):
+        comparisons.append({
+            'model_a': names[a],
+            'model_b': names[b],
+            'nr_obs': probs.shape[1],
+            'accuracy_diff': np.mean(correct[a]) - np.mean(correct[b]),
+            'p_accuracy': p_accuracy[i],
+            'mean_nll_diff': np.mean(nll[a] - nll[b]),
+            'p_nll': p_nll[i],
+            'a_more_probable': np.mean(probs[a] > probs[b]),
+            'only_a_correct': np.sum(correct[a] & ~correct[b]),
+            'only_b_correct': np.sum(correct[b] & ~correct[a])
+        })
+    return pd.DataFrame(
+        comparisons,
+        columns=['model_a', 'model_b', 'nr_obs', 'accuracy_diff',
+                 'p_accuracy', 'mean_nll_diff', 'p_nll', 'a_more_probable',
+                 'only_a_correct', 'only_b_correct']
+    )
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Evaluate the discrimination task')
+    parser.add_argument(
+        '--resamples', type=int, default=N_RESAMPLES,
+        help='number of bootstrap samples of the confidence intervals and '
+             f'of permutations of the paired tests (default: {N_RESAMPLES}); '
+             'with 0 these are skipped, and only the ids and running scores '
+             'of the files are kept in memory'
+    )
+    args = parser.parse_args()
+
+    # only the script needs the config file, not the scoring functions
+    import config
+
     paths = {
         'mono': config.DISCRIM_MONO_FILES,
         'poly': config.DISCRIM_POLY_FILES
     }
-    
-    # Score each file
-    scores = pd.DataFrame(
-        columns=['model', 'data', 'nr_obs', 'accuracy', 'mean_probability',
-                 'var_prob'],
-        dtype=float
-    )
-    scores.nr_obs = scores.nr_obs.astype(int)
-    scores.data = scores.data.astype(str)
-    scores.model = scores.model.astype(str)
-    scores.set_index(['model', 'data'], inplace=True)
-    
-    for data_type in list(paths.keys()):
-        files = paths[data_type]
-        for model_name, fn in files.items():
-            df = pd.read_csv(fn)
-            x = df.iloc[:, 1:].values
-            if not np.allclose(np.sum(x, axis=1), np.ones(x.shape[0])):
-                row_sums = x.sum(axis=1)
-                x = x / row_sums[:, np.newaxis]
-            scores.loc[(model_name, data_type), :] = get_scores(x)
-            print(get_scores(x))
-    
-    # TODO: Check files have same set of ids (warn if not)
+
+    # Score the files of all models on the ids they share, and compare every
+    # pair of models on these rows
+    columns = ['nr_obs', 'accuracy', 'mean_probability', 'var_prob',
+               'mean_nll', 'var_nll']
+    tables = []
+    comparisons = []
+    for data_type, files in paths.items():
+        if not files:
+            continue
+        ids, positions, report = align_files(files)
+        print(f'Aligned {len(ids)} {data_type} rows')
+        print(report)
+        model_scores, per_row = score_aligned(
+            files, ids, positions, keep_rows=args.resamples > 0)
+        table = pd.DataFrame(model_scores, columns=columns,
+                             index=list(files))
+        table['nr_obs'] = table['nr_obs'].astype(int)
+        if per_row is not None:
+            intervals = confidence_intervals(*per_row, n_boot=args.resamples)
+            for column in intervals.columns:
+                table[column] = intervals[column].values
+            pairs = paired_comparisons(*per_row, list(files),
+                                       n_perm=args.resamples)
+            pairs.insert(0, 'data', data_type)
+            comparisons.append(pairs)
+        table['data'] = data_type
+        tables.append(table)
+    scores = pd.concat(tables) if tables else pd.DataFrame(
+        columns=columns + ['data'])
+    scores.index.name = 'model'
+    scores = scores.set_index('data', append=True)
     
     # Output table of results
     scores.round(decimals=3).to_html(op.join(config.OUTPUT_FOLDER,
                 'discrim_table.html'))
     scores.round(decimals=3).to_latex(op.join(config.OUTPUT_FOLDER,
                 'discrim_table.tex'))
+    print(scores.round(decimals=3))
 
-    print(scores.round(decimals=3))
\ No newline at end of file
+    if comparisons:
+        pairs = pd.concat(comparisons).set_index(
+            ['data', 'model_a', 'model_b'])
+        pairs.round(decimals=3).to_html(op.join(
+            config.OUTPUT_FOLDER, 'discrim_paired_table.html'))
+        pairs.round(decimals=3).to_latex(op.join(
+            config.OUTPUT_FOLDER, 'discrim_paired_table.tex'))
+        print(pairs.round(decimals=3))
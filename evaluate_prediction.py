@@ -6,57 +6,149 @@ References
 ----------
 https://www.music-ir.org/mirex/wiki/2019:Patterns_for_Prediction
 """
+import argparse
 import re
-from glob import glob
 
 import pandas as pd
-from tqdm import tqdm
-import seaborn as sns
-import matplotlib.pyplot as plt
 
 import config
+from batch import score_models
+from cache import COLNAMES, get_fn, read_csv_dir, read_last_row
+from corpus import deduplicate
+from matching import match_model_outputs
 from pitch import score_pitch
 from cs import score_cs
-
-
-def dedup_and_preproc(df):
-    """In order that CS works correctly, we need to ensure there are no
-    duplicate points in (onset, pitch) space. Given that score do not use
-    any other data than onset and pitch, we are safe to drop other columns
-    """
-    df = df[['onset', 'pitch']].drop_duplicates()
-    return df
+from mirex2018 import score_sets
+import profiling
+from report import (render_figures, score_table_path, write_cs_table,
+                    write_pitch_tables)
+from store import ResultStore
+from streaming import score_streaming
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=1,
+        help='number of worker processes used for scoring (-1 for all CPUs)'
+    )
+    parser.add_argument(
+        '--cache-dir',
+        help='directory to cache the parsed csv files in between runs'
+    )
+    parser.add_argument(
+        '--store',
+        help='SQLite file to keep the scores of each excerpt in, so that '
+             'later runs only score excerpts and models whose files changed'
+    )
+    parser.add_argument(
+        '--stream', action='store_true',
+        help='read and score one excerpt at a time, writing the scores to '
+             'tables in the output folder (ignores --cache-dir and --store)'
+    )
+    parser.add_argument(
+        '--no-plots', action='store_true',
+        help='do not draw the figures, only write the tables of scores to '
+             'the output folder'
+    )
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='record the time and memory use of each stage, and the slowest '
+             'excerpts, in <FILENAME_FRAGMENT>_profile.json and .csv in the '
+             'output folder'
+    )
+    parser.add_argument(
+        '--profile-stage', action='append', default=[], metavar='STAGE',
+        help='run a stage (e.g. cs, or plot) under cProfile, writing '
+             'the statistics to the output folder; implies --profile. '
+             'With --jobs > 1, cProfile only sees the main process'
+    )
+    args = parser.parse_args()
+    if args.profile or args.profile_stage:
+        profiling.enable(args.profile_stage)
+
     PATH = config.DATASET_PATH
-    # CSV column keys in dataset
-    COLNAMES = ['onset', 'pitch', 'morph', 'dur', 'ch']
-
-    def get_fn(path):
-        """Get the filename of the csv file to evaluate"""
-        return path.split('/')[-1].split('.')[0]
-
-    print('Reading PPTD csv files')
-    prime = {get_fn(path): pd.read_csv(path, names=COLNAMES)
-             for path in tqdm(glob(f'{PATH}/prime_csv/*'))}
-    cont_true = {get_fn(path): pd.read_csv(path, names=COLNAMES)
-                 for path in tqdm(glob(f'{PATH}/cont_true_csv/*'))}
-    # preprocessing to remove duplicates
-    cont_true = {fn: dedup_and_preproc(df) for fn, df in cont_true.items()}
-    fn_list = list(prime.keys())
-
-    files_dict = {}
-    alg_names = config.MODEL_DIRS.keys()
-    for alg in alg_names:
-        print(f'Reading {alg} output files')
-        alg_cont = {
-            get_fn(path): pd.read_csv(path, names=config.MODEL_KEYS[alg])
-            for path in tqdm(glob(f'{config.MODEL_DIRS[alg]}/*.csv'))
-        }
-        # preprocessing to remove duplicates
-        alg_cont = {fn: dedup_and_preproc(df) for fn, df in alg_cont.items()}
-        files_dict[alg] = alg_cont
+    if args.stream:
+        cs_path = score_table_path('cs')
+        pitch_path = score_table_path('pitch')
+        set_path = score_table_path('set')
+        score_streaming(PATH, config.MODEL_DIRS, config.MODEL_KEYS, cs_path,
+                        pitch_path, set_path, n_jobs=args.jobs)
+        scores_df = pd.read_csv(pitch_path, float_precision='round_trip')
+        card_df = pd.read_csv(cs_path, float_precision='round_trip')
+        write_pitch_tables(scores_df)
+        write_cs_table(card_df)
+        if not args.no_plots:
+            with profiling.stage('plot'):
+                render_figures(
+                    card_df,
+                    scores_df,
+                    pd.read_csv(set_path, float_precision='round_trip'),
+                    n_jobs=args.jobs)
+    else:
+        print('Reading PPTD csv files')
+        # only the last onset of the primes is used, so only the last row of
+        # each prime is read
+        with profiling.stage('read prime'):
+            prime = read_csv_dir(f'{PATH}/prime_csv/*', COLNAMES,
+                                 cache_dir=args.cache_dir, key=get_fn,
+                                 reader=read_last_row)
+        with profiling.stage('read cont_true'):
+            cont_true = read_csv_dir(f'{PATH}/cont_true_csv/*', COLNAMES,
+                                     cache_dir=args.cache_dir, key=get_fn)
+        # duplicates are removed from all excerpts at once
+        with profiling.stage('deduplicate'):
+            cont_true = deduplicate(cont_true)
+        fn_list = prime.keys()
 
-    score_pitch(fn_list, alg_names, files_dict, cont_true) 
-    score_cs(fn_list, alg_names, files_dict, cont_true, prime)
+        files_dict = {}
+        alg_names = config.MODEL_DIRS.keys()
+        for alg in alg_names:
+            print(f'Reading {alg} output files')
+            with profiling.stage('read', alg):
+                files_dict[alg] = read_csv_dir(
+                    f'{config.MODEL_DIRS[alg]}/*.csv', config.MODEL_KEYS[alg],
+                    cache_dir=args.cache_dir, key=get_fn)
+            with profiling.stage('deduplicate', alg):
+                files_dict[alg] = deduplicate(files_dict[alg])
+
+        print('Matching model output files')
+        with profiling.stage('match'):
+            matches = match_model_outputs(fn_list, files_dict, alg_names)
+
+        store = ResultStore(args.store) if args.store else None
+        # the models are scored one by one in their own 'cs' and 'pitch'
+        # stages with a store, or to run those stages under cProfile
+        if store is None and not (profiling.is_cprofiled('cs') or
+                                  profiling.is_cprofiled('pitch')):
+            # all models are scored against each excerpt at once
+            with profiling.stage('score models'):
+                card_df, scores_df = score_models(
+                    fn_list, alg_names, files_dict, cont_true, prime,
+                    n_jobs=args.jobs, matches=matches)
+            write_pitch_tables(scores_df)
+            write_cs_table(card_df)
+        else:
+            scores_df = score_pitch(fn_list, alg_names, files_dict,
+                                    cont_true, n_jobs=args.jobs,
+                                    matches=matches, store=store, plot=False)
+            card_df = score_cs(fn_list, alg_names, files_dict, cont_true,
+                               prime, n_jobs=args.jobs, matches=matches,
+                               store=store, plot=False)
+        scores = {
+            'pitch': scores_df,
+            'cs': card_df,
+            'set': score_sets(fn_list, alg_names, files_dict, cont_true,
+                              prime, n_jobs=args.jobs, matches=matches,
+                              store=store, plot=False)
+        }
+        if args.no_plots:
+            for name, df in scores.items():
+                df.to_csv(score_table_path(name), index=False)
+        else:
+            with profiling.stage('plot'):
+                render_figures(scores['cs'], scores['pitch'], scores['set'],
+                               n_jobs=args.jobs)
+        if store is not None:
+            store.close()
+    profiling.write(config.OUTPUT_FOLDER, config.FILENAME_FRAGMENT)
@@ -0,0 +1,90 @@
+"""Matching of the true continuation file names to the file names of the
+generated continuations, which may have additions to the original name."""
+import warnings
+
+
+def match_filenames(fn_list, generated_fns):
+    '''Find, for every file name in `fn_list`, the generated file names that
+    contain it. All substrings of the generated file names with the length of
+    a true file name are looked up in a set, so this takes time linear in the
+    total length of the generated file names (times the number of distinct
+    lengths of the true file names).
+
+    Parameters
+    ----------
+    fn_list : list[str]
+        The file names (without extension) of the true continuations
+    generated_fns : iterable[str]
+        The file names (without extension) of the generated continuations
+
+    Returns
+    -------
+    matches : dict[str, str]
+        For every matched true file name, the first generated file name (in
+        the order of `generated_fns`) containing it
+    unmatched : list[str]
+        The true file names not contained in any generated file name
+    ambiguous : dict[str, list[str]]
+        The true file names contained in more than one generated file name,
+        with all of those generated file names
+    '''
+    fn_set = set(fn_list)
+    lengths = sorted({len(fn) for fn in fn_set})
+    candidates = {}
+    for generated_fn in generated_fns:
+        found = set()
+        for length in lengths:
+            for start in range(len(generated_fn) - length + 1):
+                substring = generated_fn[start:start + length]
+                if substring in fn_set and substring not in found:
+                    found.add(substring)
+                    candidates.setdefault(substring, []).append(generated_fn)
+    matches = {fn: candidates[fn][0] for fn in fn_list if fn in candidates}
+    unmatched = [fn for fn in fn_list if fn not in candidates]
+    ambiguous = {fn: candidates[fn] for fn in fn_list
+                 if len(candidates.get(fn, [])) > 1}
+    return matches, unmatched, ambiguous
+
+
+def match_model_outputs(fn_list, files_dict, alg_names=None):
+    '''Match the true file names to the output files of every model, before
+    any scoring starts. Raises a ValueError if a model has no output for some
+    of the true continuations, and warns if a true file name matches several
+    outputs of a model (the first one is used).
+
+    Parameters
+    ----------
+    fn_list : list[str]
+        The file names (without extension) of the true continuations
+    files_dict : dict[str, dict]
+        For every model, a dictionary with the generated file names as keys
+    alg_names : iterable[str], optional
+        The models to match, defaults to all keys of `files_dict`
+
+    Returns
+    -------
+    output : dict[str, dict[str, str]]
+        For every model, the generated file name of every true file name
+    '''
+    if alg_names is None:
+        alg_names = files_dict.keys()
+    output = {}
+    for alg in alg_names:
+        matches, unmatched, ambiguous = match_filenames(
+            fn_list, files_dict[alg].keys())
+        if ambiguous:
+            examples = ', '.join(
+                f'{fn} ({", ".join(names)})'
+                for fn, names in list(ambiguous.items())[:5]
+            )
+            warnings.warn(
+                f'{len(ambiguous)} files match several outputs of {alg}, '
+                f'using the first match: {examples}'
+            )
+        if unmatched:
+            raise ValueError(
+                f'No output of {alg} found for {len(unmatched)} files: '
+                f'{", ".join(unmatched[:5])}'
+            )
+        output[alg] = matches
+    return output
@@ -1,30 +1,40 @@
-import re
-
+import numpy as np
 import pandas as pd
-from tqdm import tqdm
-import seaborn as sns
-import matplotlib.pyplot as plt
 
-import config
+from corpus import as_corpus
+from cs import (EVALUATE_FROM_ONSET, EVALUATE_UNTIL_ONSET, ONSET_INCREMENT,
+                evaluation_cutoffs)
+from matching import match_model_outputs
+from parallel import map_tasks
+import profiling
+
+# The sets compared by the set score, with the columns of the (pitch, ioi)
+# keys of an event that they consist of
+SETS = {'Pitch': [0], 'IOI': [1], 'Pitch-IOI': [0, 1]}
+# Name of the set scores in a `store.ResultStore`
+STORE_NAME = (f'sets|{ONSET_INCREMENT}|{EVALUATE_FROM_ONSET}|'
+              f'{EVALUATE_UNTIL_ONSET}')
+
 
 def evaluate_sets(
     original, 
     generated, 
+    last_onset_prime,
+    onset_increment,
     evaluate_from_onset, 
-    onset_increment, 
     evaluate_until_onset):
     """ Given the original and the generated continuation
-    of the test item (in onset/pitch dictionaries),
+    of the test item (in onset/pitch dataframes),
     collect the following events (which can be mulitple pitches),
     and determine how many pitches / iois and pitch/ioi pairs are shared between 
     generated and original piece.
     onset_increment determines the increase of onset steps in evaluation.
-    For the first ioi, the last event of the prime is also required.
+    For the iois, the last onset of the prime is also required:
+    the ioi of an event is its onset after the last onset of the prime.
     'evaluate_until_onset' determines until how many quarter notes 
     after the cut-off point we evaluate.
-    Output is a list of dictionaries, 
-    in which the key indicates the onsets after cut-off
-    for which correct number of pitches, iois and pitch/ioi pairs are listed.
+    Events are matched as multisets, so every event in one continuation
+    matches at most one event in the other.
 
     Parameters
     ----------
@@ -34,125 +44,164 @@ def evaluate_sets(
     generated : pd.DataFrame
         A dataframe containing columns 'onset' and 'pitch' representing the
         generated continuation to be evaluated
+    last_onset_prime : float
+        The onset time of the last onset of the prime
+    onset_increment : float
+        The increment to increase onset steps by for evaluation
+    evaluate_from_onset : float
+        The minimum number of onsets after `last_onset_prime` to evaluate the
+        continuation from
+    evaluate_until_onset : float
+        The maximum number of onsets after `last_onset_prime` to evaluate the
+        continuation to
 
     Returns
     -------
-    output : dict[float]
-        A dictionary containing three keys: 'rec', 'prec' and 'F1', the recall
-        precision and the F1 of the cardinality score.
+    output : pd.DataFrame
+        A dataframe containing the columns 'Onset' (evaluation is up to this
+        onset), 'Set' ('Pitch', 'IOI' or 'Pitch-IOI'), and 'Precision',
+        'Recall' and 'F1' of the set score
+    """
+    scores = set_scores(
+        original[['onset', 'pitch']].values,
+        generated[['onset', 'pitch']].values,
+        last_onset_prime, onset_increment, evaluate_from_onset,
+        evaluate_until_onset
+    )
+    return pd.DataFrame(scores)
+
+
+def set_scores(original_vec, generated_vec, last_onset_prime,
+               onset_increment, evaluate_from_onset, evaluate_until_onset):
+    """Array version of `evaluate_sets`: `original_vec` and `generated_vec`
+    are arrays of (onset, pitch) rows, and the scores are returned as a
+    dictionary of lists with keys 'Onset', 'Set', 'Precision', 'Recall' and
+    'F1'.
     """
-    scores = {'precision': {}, 'recall': {}, 'F1': {}}
-    nr_steps = int((evaluate_until_onset - evaluate_from_onset)
-                   / onset_increment)
-    original_onsets = sorted(list(set(original[['onset']].values())))
-    generated_onsets = sorted(list(set(generated[['onset']].values())))
-    max_onset = evaluate_from_onset + evaluate_until_onset
-    for step in range(1, nr_steps+1):
-        cutoff = evaluate_from_onset + step * onset_increment
-        if cutoff <= max_onset:
-            original_events = original[['onset'] <= cutoff]
-            generated_events = generated[['onset'] <= cutoff]
-            if not generated_events or not original_events:
+    scores = {'Onset': [], 'Set': [], 'Precision': [], 'Recall': [],
+              'F1': []}
+    cutoffs = list(evaluation_cutoffs(
+        last_onset_prime, onset_increment, evaluate_from_onset,
+        evaluate_until_onset))
+    if not cutoffs:
+        return scores
+    onsets = [onset for onset, cutoff in cutoffs]
+    cutoff_times = np.array([cutoff for onset, cutoff in cutoffs])
+    # every event counts from the first cutoff at or after its onset, so the
+    # sets at all cutoffs follow from cumulative counts over these steps
+    keys = []
+    steps = []
+    for vec in (original_vec, generated_vec):
+        vec = np.asarray(vec, dtype=float).reshape(-1, 2)
+        keys.append(np.column_stack((
+            np.trunc(vec[:, 1]),
+            np.round(vec[:, 0] - last_onset_prime, 2)
+        )))
+        steps.append(np.searchsorted(cutoff_times, vec[:, 0], side='left'))
+    nr_original, nr_generated = [
+        np.cumsum(np.bincount(step, minlength=len(cutoffs) + 1))[:-1]
+        for step in steps
+    ]
+    for set_name, columns in SETS.items():
+        correct = _multiset_intersections(
+            keys[0][:, columns], steps[0], keys[1][:, columns], steps[1],
+            len(cutoffs)
+        )
+        for i, onset in enumerate(onsets):
+            scores['Onset'].append(onset)
+            scores['Set'].append(set_name)
+            if nr_original[i] == 0 or nr_generated[i] == 0:
+                scores['Precision'].append(None)
+                scores['Recall'].append(None)
+                scores['F1'].append(None)
                 continue
-            original_pitches = [int(o['pitch']) for o in original_events]
-            generated_pitches = [int(g['pitch']) for g in generated_events]
-            original_iois = [
-                round(
-                    float(o['onset']) - last_onset_prime, 2
-                ) for o in original_events
-            ]
-            generated_iois = [
-                round(
-                    float(g['onset']) - last_onset_prime, 2
-                ) for g in generated_events
-            ]
-            original_pairs = list(zip(original_pitches, original_iois))
-            generated_pairs = list(zip(generated_pitches, generated_iois))
-            correct_pitches_at_n = 0
-            correct_iois_at_n = 0
-            correct_pairs_at_n = 0
-            for event in generated_pitches:
-                if event in original_pitches:
-                    correct_pitches_at_n += 1
-                    original_pitches.pop(original_pitches.index(event))
-            for event in generated_iois:
-                if event in original_iois:
-                    correct_iois_at_n += 1
-                    original_iois.pop(original_iois.index(event))
-            for event in generated_pairs:
-                if event in original_pairs:
-                    correct_pairs_at_n += 1
-                    original_pairs.pop(original_pairs.index(event))
-            prec_pitch = correct_pitches_at_n / len(generated_events)
-            prec_ioi = correct_iois_at_n / len(generated_events)
-            prec_pairs = correct_pairs_at_n / len(generated_events)
-            rec_pitch = correct_pitches_at_n / len(original_events)
-            rec_ioi = correct_iois_at_n / len(original_events)
-            rec_pairs = correct_pairs_at_n / len(original_events)
-            outputlist.append({
-                'onset': onset - last_onset_prime,
-                'pitches_correct': correct_pitches_at_n,
-                'iois_correct': correct_iois_at_n,
-                'pitch_ioi_pairs_correct': correct_pairs_at_n,
-                'no_predicted_events': len(original_events),
-                'prec_pitch': prec_pitch,
-                'prec_ioi': prec_ioi,
-                'prec_pairs': prec_pairs,
-                'rec_pitch': rec_pitch,
-                'rec_ioi': rec_ioi,
-                'rec_pairs': rec_pairs
-            })
-    return outputlist
+            precision = correct[i] / float(nr_generated[i])
+            recall = correct[i] / float(nr_original[i])
+            if precision + recall == 0:
+                f1 = 0.0
+            else:
+                f1 = 2 * precision * recall / (precision + recall)
+            scores['Precision'].append(precision)
+            scores['Recall'].append(recall)
+            scores['F1'].append(f1)
+    return scores
+
+
+def _multiset_intersections(original_keys, original_steps, generated_keys,
+                            generated_steps, nr_steps):
+    """Size of the multiset intersection of the original and generated keys
+    (rows) of all events up to each step. Events with a step of `nr_steps` or
+    later are beyond the last cutoff and ignored."""
+    nr_original = len(original_keys)
+    all_keys = np.concatenate((original_keys, generated_keys))
+    if len(all_keys) == 0:
+        return np.zeros(nr_steps, dtype=int)
+    unique, inverse = np.unique(all_keys, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    counts = []
+    for key_ids, steps in ((inverse[:nr_original], original_steps),
+                           (inverse[nr_original:], generated_steps)):
+        in_range = steps < nr_steps
+        histogram = np.bincount(
+            key_ids[in_range] * nr_steps + steps[in_range],
+            minlength=len(unique) * nr_steps
+        ).reshape(len(unique), nr_steps)
+        counts.append(np.cumsum(histogram, axis=1))
+    return np.minimum(counts[0], counts[1]).sum(axis=0)
 
 
-    def score_sets(fn_list, alg_names, files_dict, cont_true, prime):
-    set_scores = {alg: {} for alg in alg_names}
+def _score_sets_task(task):
+    """Score one excerpt in a worker process, from the onsets and pitches of
+    the true and generated continuations and the last onset of the prime"""
+    (true_onsets, true_pitches, gen_onsets, gen_pitches,
+     prime_final_onset) = task
+    return set_scores(
+        np.column_stack((true_onsets, true_pitches)).astype(float),
+        np.column_stack((gen_onsets, gen_pitches)).astype(float),
+        prime_final_onset,
+        ONSET_INCREMENT, EVALUATE_FROM_ONSET, EVALUATE_UNTIL_ONSET
+    )
+
+
+def score_sets(fn_list, alg_names, files_dict, cont_true, prime, n_jobs=1,
+               chunksize=None, matches=None, store=None, plot=True):
+    cont_true = as_corpus(cont_true)
+    prime = as_corpus(prime)
+    files_dict = {alg: as_corpus(files_dict[alg]) for alg in alg_names}
+    set_scores_list = []
+    if matches is None:
+        matches = match_model_outputs(fn_list, files_dict, alg_names)
     for alg in alg_names:
         print(f'Scoring {alg} with set score')
-        for fn in tqdm(fn_list):
-            # the generated file name may have additions to original file name
-            generated_fn = next(
-                (alg_fn for alg_fn in files_dict[alg].keys()
-                 if re.search(fn, alg_fn)),
-                None
-            )
-            true_df = cont_true[fn]
-            gen_df = files_dict[alg][generated_fn]
-            prime_final_onset = prime[fn].iloc[-1]['onset']
-            card_scores[alg][fn] = evaluate_continuation(
-                true_df,
-                gen_df,
-                prime_final_onset,
-                0.5, 2.0, 10.0
-            )
-    
-    df_list = []
-    for measure in ['recall', 'precision', 'F1']:
-        metric = 'set'
-        for key in set_scores.keys():
-            data = {fn: set_scores[key][fn][measure] for fn in fn_list}
-            df = (pd.DataFrame
-                    .from_dict(data, orient='index')
-                    .reset_index()
-                    .rename(columns={'index': 'fn'})
-                    .melt(id_vars=['fn'], var_name='t',
-                          value_name=f'{metric} score')
-            )
-            df['model'] = key
-            df_list.append(df)
-        plt.figure()
-        sns.set_style("whitegrid")
-        g = sns.lineplot(
-            x='t',
-            y=f'{metric} score',
-            hue='model',
-            hue_order=config.MODEL_DIRS.keys(),
-            style='model',
-            style_order=config.MODEL_DIRS.keys(),
-            markers=['o', 'v', 's'],
-            data=pd.concat((df_list), axis=0)
-        )
-        g.set(xlabel='Onset', ylabel=str.title(measure))
-        plt.title(f'Comparison by {measure} of {metric} score')
-        filename = f"{metric}_score__{measure}.png"
-        plt.savefig(filename, dpi=300)
\ No newline at end of file
+        with profiling.stage('sets', alg):
+            tasks = []
+            for fn in fn_list:
+                # the generated file name may have additions to original
+                # file name
+                generated_fn = matches[alg][fn]
+                prime_final_onset = float(prime.points(fn)[0][-1])
+                tasks.append(
+                    cont_true.points(fn)
+                    + files_dict[alg].points(generated_fn)
+                    + (prime_final_onset,)
+                )
+            if store is None:
+                results = map_tasks(
+                    _score_sets_task, tasks, n_jobs, chunksize, fn_list)
+            else:
+                results = store.map_tasks(
+                    _score_sets_task, tasks, STORE_NAME, n_jobs, chunksize,
+                    fn_list)
+        for fn, scores in zip(fn_list, results):
+            set_score = pd.DataFrame(scores)
+            set_score['fn'] = fn
+            set_score['Model'] = alg
+            set_scores_list.append(set_score)
+    set_df = pd.concat(set_scores_list, axis=0)
+    if plot:
+        # the figures need the config file and plotting libraries, which
+        # the scores themselves do not
+        from report import plot_sets
+        with profiling.stage('plot sets'):
+            plot_sets(set_df)
+    return set_df
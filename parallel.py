@@ -0,0 +1,69 @@
+"""Helpers to spread independent scoring tasks over worker processes."""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from tqdm import tqdm
+
+import profiling
+
+
+def map_tasks(func, tasks, n_jobs=1, chunksize=None, names=None):
+    '''Apply `func` to every task, optionally in a pool of worker processes.
+    The results are returned in the order of `tasks`, whatever the number of
+    workers.
+
+    Parameters
+    ----------
+    func : callable
+        A module level function taking a single task, so that it can be
+        pickled to the workers
+    tasks : iterable
+        The tasks; these are sent to the workers, so should be small (e.g.
+        tuples of arrays rather than dataframes)
+    n_jobs : int, optional
+        The number of worker processes; 1 (default) runs in this process and
+        -1 uses all CPUs
+    chunksize : int, optional
+        The number of tasks sent to a worker at once, by default the tasks
+        are split in about four chunks per worker
+    names : list of str, optional
+        Names of the tasks (e.g. excerpts), under which their run times are
+        recorded when profiling is enabled, see `profiling`
+
+    Returns
+    -------
+    output : list
+        The result of `func` for each task
+    '''
+    tasks = list(tasks)
+    return list(
+        imap_tasks(func, tasks, n_jobs, chunksize, len(tasks), names))
+
+
+def imap_tasks(func, tasks, n_jobs=1, chunksize=None, total=None,
+               names=None):
+    '''Like `map_tasks`, but yield the results one by one (in the order of
+    `tasks`) as they become available. `total` is the number of tasks, if
+    known; it is used for the progress bar and the default chunksize.'''
+    if names is None or not profiling.is_enabled():
+        yield from _imap(func, tasks, n_jobs, chunksize, total)
+        return
+    results = _imap(profiling.timed(func), tasks, n_jobs, chunksize, total)
+    for name, (result, seconds) in zip(names, results):
+        profiling.add_tasks([name], [seconds])
+        yield result
+
+
+def _imap(func, tasks, n_jobs, chunksize, total):
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs == 1 or (total is not None and total <= 1):
+        for task in tqdm(tasks, total=total):
+            yield func(task)
+        return
+    if chunksize is None:
+        chunksize = max(1, (total or 0) // (4 * n_jobs))
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        for result in tqdm(executor.map(func, tasks, chunksize=chunksize),
+                           total=total):
+            yield result
@@ -1,12 +1,17 @@
-import re
-import os.path as op
-
+import numpy as np
 import pandas as pd
-from tqdm import tqdm
-import seaborn as sns
-import matplotlib.pyplot as plt
 
-import config
+from corpus import as_corpus
+from matching import match_model_outputs
+from parallel import map_tasks
+import profiling
+from store import task_key
+
+# Number of bins of the pitch histograms of `pitch_histograms` (MIDI pitches)
+NR_PITCHES = 128
+# Name of the pitch scores in a `store.ResultStore`
+STORE_NAME = 'pitch'
+
 
 def evaluate_pitch_score(original, generated, ignore_octave=False):
     '''Given a original and generated events, calculate the pitch score. It is
@@ -45,28 +50,169 @@ def evaluate_pitch_score(original, generated, ignore_octave=False):
     return overlap
 
 
-def score_pitch(fn_list, alg_names, files_dict, cont_true):
+def pitch_histograms(pitches, offsets):
+    '''Count the pitches of many excerpts at once, given as one flat array
+    with CSR-style offsets (as in `corpus.Corpus`).
+
+    Parameters
+    ----------
+    pitches : np.ndarray
+        The pitches of all excerpts, concatenated
+    offsets : np.ndarray
+        The start of every excerpt in `pitches`, followed by the total number
+        of pitches
+
+    Returns
+    -------
+    counts : np.ndarray or None
+        An array of shape (number of excerpts, `NR_PITCHES`) with the number
+        of occurrences of every MIDI pitch in every excerpt, or None if some
+        pitches are not integers in the MIDI range
+    '''
+    pitches = np.asarray(pitches)
+    if len(pitches) and (np.any(pitches != np.round(pitches))
+                         or pitches.min() < 0
+                         or pitches.max() >= NR_PITCHES):
+        return None
+    nr_excerpts = len(offsets) - 1
+    excerpts = np.repeat(np.arange(nr_excerpts), np.diff(offsets))
+    counts = np.bincount(
+        excerpts * NR_PITCHES + pitches.astype(np.int64),
+        minlength=nr_excerpts * NR_PITCHES
+    )
+    return counts.reshape(nr_excerpts, NR_PITCHES)
+
+
+def evaluate_pitch_scores(original_counts, generated_counts):
+    '''Vectorised version of `evaluate_pitch_score` for many excerpts at
+    once, from pitch histograms as returned by `pitch_histograms`.
+
+    Parameters
+    ----------
+    original_counts : np.ndarray
+        The pitch counts of the true continuations, one row per excerpt
+    generated_counts : np.ndarray
+        The pitch counts of the generated continuations, in the same order
+
+    Returns
+    -------
+    pitch_scores : np.ndarray
+        The overlap of the normalised pitch histograms of every excerpt
+    pitch_scores_nooctave : np.ndarray
+        The overlap of the normalised pitch class histograms of every excerpt
+    '''
+    scores = []
+    for fold in (False, True):
+        overlap = None
+        for counts in (original_counts, generated_counts):
+            if fold:
+                counts = np.stack(
+                    [counts[:, pitch_class::12].sum(axis=1)
+                     for pitch_class in range(12)], axis=1)
+            totals = counts.sum(axis=1, keepdims=True)
+            # an empty excerpt has an empty histogram, and no overlap
+            histogram = counts / np.maximum(totals, 1)
+            if overlap is None:
+                overlap = histogram
+            else:
+                overlap = np.minimum(overlap, histogram)
+        scores.append(overlap.sum(axis=1))
+    return tuple(scores)
+
+
+def pitch_scores_models(original_pitches, generated_pitches):
+    '''The pitch scores of several generated continuations (e.g. the
+    outputs of all models) against the same original continuation, whose
+    histogram is only counted once.
+
+    Parameters
+    ----------
+    original_pitches : np.ndarray
+        The pitches of the true continuation
+    generated_pitches : list[np.ndarray]
+        The pitches of every generated continuation
+
+    Returns
+    -------
+    output : list[tuple]
+        The pitch score and the pitch class score of every generated
+        continuation
+    '''
+    all_pitches = [original_pitches] + list(generated_pitches)
+    lengths = [len(pitches) for pitches in all_pitches]
+    counts = pitch_histograms(
+        np.concatenate(all_pitches), np.concatenate(([0], np.cumsum(lengths))))
+    if counts is None:
+        # pitches outside the MIDI range: score the outputs one by one
+        return [_score_pitch_task((original_pitches, pitches))
+                for pitches in generated_pitches]
+    original_counts = np.repeat(counts[:1], len(generated_pitches), axis=0)
+    return list(zip(*evaluate_pitch_scores(original_counts, counts[1:])))
+
+
+def _score_pitch_task(task):
+    """Score one excerpt in a worker process, from the pitch arrays of the
+    true and generated continuations"""
+    true_pitches, gen_pitches = task
+    true_df = pd.DataFrame({'pitch': true_pitches})
+    gen_df = pd.DataFrame({'pitch': gen_pitches})
+    pitch_score = evaluate_pitch_score(
+        true_df,
+        gen_df
+    )
+    pitch_score_nooctave = evaluate_pitch_score(
+        true_df,
+        gen_df,
+        ignore_octave=True
+    )
+    return pitch_score, pitch_score_nooctave
+
+
+def score_pitch(fn_list, alg_names, files_dict, cont_true, n_jobs=1,
+                chunksize=None, matches=None, store=None, plot=True):
+    cont_true = as_corpus(cont_true)
+    files_dict = {alg: as_corpus(files_dict[alg]) for alg in alg_names}
+    fn_list = list(fn_list)
     pitch_scores = []
+    if matches is None:
+        matches = match_model_outputs(fn_list, files_dict, alg_names)
+    true_counts = pitch_histograms(cont_true.pitches, cont_true.offsets)
+    true_slots = [cont_true.index[fn] for fn in fn_list]
     for alg in alg_names:
         print(f'Scoring {alg} with pitch score')
-        for fn in tqdm(fn_list):
-            # the generated file name may have additions to original file name
-            generated_fn = next(
-                (alg_fn for alg_fn in files_dict[alg].keys()
-                 if re.search(fn, alg_fn)),
-                None
-            )
-            true_df = cont_true[fn]
-            gen_df = files_dict[alg][generated_fn]
-            pitch_score = evaluate_pitch_score(
-                true_df,
-                gen_df
-            )
-            pitch_score_nooctave = evaluate_pitch_score(
-                true_df,
-                gen_df,
-                ignore_octave=True
-            )
+        with profiling.stage('pitch', alg):
+            # the generated file name may have additions to original
+            # file name
+            generated_fns = [matches[alg][fn] for fn in fn_list]
+            gen_counts = pitch_histograms(
+                files_dict[alg].pitches, files_dict[alg].offsets)
+            tasks = [
+                (cont_true.points(fn)[1],
+                 files_dict[alg].points(generated_fn)[1])
+                for fn, generated_fn in zip(fn_list, generated_fns)
+            ]
+            todo = list(range(len(tasks)))
+            if store is not None:
+                keys = [task_key(STORE_NAME, task) for task in tasks]
+                found = store.lookup(keys)
+                todo = [i for i, key in enumerate(keys) if key not in found]
+                print(f'{len(tasks) - len(todo)} of {len(tasks)} scores found '
+                      'in the result store')
+            if true_counts is not None and gen_counts is not None:
+                gen_slots = [files_dict[alg].index[fn] for fn in generated_fns]
+                results = list(zip(*evaluate_pitch_scores(
+                    true_counts[[true_slots[i] for i in todo]],
+                    gen_counts[[gen_slots[i] for i in todo]])))
+            else:
+                # pitches outside the MIDI range: score the excerpts one by one
+                results = map_tasks(
+                    _score_pitch_task, [tasks[i] for i in todo], n_jobs,
+                    chunksize, [fn_list[i] for i in todo])
+            if store is not None:
+                store.save([keys[i] for i in todo], results)
+                found.update(zip([keys[i] for i in todo], results))
+                results = [found[key] for key in keys]
+        for fn, (pitch_score, pitch_score_nooctave) in zip(fn_list, results):
             pitch_scores.append(
                 {'fn': fn,
                 'Pitch': pitch_score, 
@@ -74,38 +220,10 @@ def score_pitch(fn_list, alg_names, files_dict, cont_true):
                 'Model': alg}
             )
     scores_df = pd.DataFrame.from_dict(pitch_scores)
-    data = scores_df.melt(
-        id_vars=['fn', 'Model'], 
-        value_vars=['Pitch', 'Modulo12Pitch'],
-        var_name='score')
-    plt.figure()
-    sns.set_style("whitegrid")
-    g = sns.FacetGrid(
-        data,
-        col='score',
-        hue='Model',
-        hue_order=config.MODEL_DIRS.keys()
-        )
-    g = g.map(
-        sns.violinplot,
-        'value',
-        'Model',
-        order=config.MODEL_DIRS.keys()
-        # scale='width', bw=.1, cut=0
-    )
-    filename = op.join(config.OUTPUT_FOLDER, '{}_pitch_scores.png'.format(config.FILENAME_FRAGMENT))
-    plt.savefig(filename, dpi=300)
-
-    # tables
-    pitch_stats = scores_df.groupby('Model').agg(
-        {'Pitch':['mean', 'median', 'std']})
-    rounded_pitch_score_table = pitch_stats.round(decimals=3)
-    filename = op.join(config.OUTPUT_FOLDER, '{}_pitch_table'.format(config.FILENAME_FRAGMENT))
-    rounded_pitch_score_table.to_html(filename + '.html')
-    rounded_pitch_score_table.to_latex(filename + '.tex')
-    pitch_no_octave_stats = scores_df.groupby('Model').agg(
-        {'Modulo12Pitch':['mean', 'median', 'std']})
-    rounded_pitch_score_table = pitch_no_octave_stats.round(decimals=3)
-    filename = op.join(config.OUTPUT_FOLDER, '{}_pitch_no_octave_table'.format(config.FILENAME_FRAGMENT))
-    rounded_pitch_score_table.to_html(filename + '.html')
-    rounded_pitch_score_table.to_latex(filename + '.tex')
\ No newline at end of file
+    # the figures and tables need the config file, which the scores do not
+    from report import plot_pitch, write_pitch_tables
+    if plot:
+        with profiling.stage('plot pitch'):
+            plot_pitch(scores_df)
+    write_pitch_tables(scores_df)
+    return scores_df
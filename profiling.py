@@ -0,0 +1,216 @@
+"""Opt-in instrumentation of an evaluation run: the wall time, CPU time and
+peak memory use of each stage (per model), and the run time of each excerpt.
+
+Profiling is off unless `enable` is called, in which case `stage` records the
+stages it wraps, and `parallel.map_tasks` records the run time of the tasks
+it is given names for. Stages run in this process can also be run under
+cProfile; with several worker processes, cProfile only sees the work done in
+this process, not the tasks run by the workers.
+"""
+import cProfile
+from contextlib import contextmanager
+import json
+import os
+import os.path as op
+import sys
+import time
+import warnings
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows; peak memory use is not recorded there
+    resource = None
+
+# Number of slowest excerpts reported per stage
+SLOWEST_EXCERPTS = 10
+
+_profiler = None
+
+
+class Profiler(object):
+    '''The records of a profiled run.
+
+    Parameters
+    ----------
+    cprofile_stages : iterable of str, optional
+        The names of the stages to run under cProfile
+    '''
+    def __init__(self, cprofile_stages=()):
+        self.cprofile_stages = set(cprofile_stages)
+        self.stages = []
+        self.tasks = []
+        self.cprofiles = {}
+        self._current = []
+
+    @contextmanager
+    def stage(self, name, model=None):
+        """Record the wall time, CPU time (including finished worker
+        processes) and the peak memory use after the stage. Nested stages
+        are recorded separately, and repeated stages are added up."""
+        self._current.append((name, model))
+        profile = None
+        if name in self.cprofile_stages:
+            profile = cProfile.Profile()
+            profile.enable()
+        start_wall = time.perf_counter()
+        start_cpu = _cpu_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = _cpu_time() - start_cpu
+            if profile is not None:
+                profile.disable()
+                self.cprofiles[(name, model)] = profile
+            self._current.pop()
+            self._add_stage(name, model, wall, cpu)
+
+    def _add_stage(self, name, model, wall, cpu):
+        for record in self.stages:
+            if record['stage'] == name and record['model'] == model:
+                record['wall_seconds'] += wall
+                record['cpu_seconds'] += cpu
+                record['calls'] += 1
+                record.update(_peak_memory())
+                return
+        self.stages.append(dict(
+            {'stage': name, 'model': model, 'wall_seconds': wall,
+             'cpu_seconds': cpu, 'calls': 1},
+            **_peak_memory()
+        ))
+
+    def add_tasks(self, names, seconds):
+        """Record the run times of named tasks, under the current stage"""
+        stage, model = self._current[-1] if self._current else (None, None)
+        self.tasks.extend(
+            {'stage': stage, 'model': model, 'excerpt': name,
+             'seconds': task_seconds}
+            for name, task_seconds in zip(names, seconds)
+        )
+
+    def slowest_tasks(self, n=SLOWEST_EXCERPTS):
+        """The `n` slowest tasks of each stage and model"""
+        if not self.tasks:
+            return pd.DataFrame(
+                columns=['stage', 'model', 'excerpt', 'seconds'])
+        tasks = pd.DataFrame(self.tasks).sort_values(
+            'seconds', ascending=False, kind='mergesort')
+        # tasks outside a stage or model are grouped too (`groupby` drops
+        # missing keys)
+        return tasks.groupby(
+            [tasks['stage'].fillna(''), tasks['model'].fillna('')],
+            sort=False).head(n)
+
+    def write(self, folder, fragment):
+        """Write the stages to `<fragment>_profile.csv`, the stages and the
+        slowest excerpts to `<fragment>_profile.json`, and the cProfile
+        statistics of a stage to `<fragment>_<stage>[_<model>].prof`"""
+        stages = pd.DataFrame(self.stages)
+        stages.to_csv(op.join(folder, f'{fragment}_profile.csv'), index=False)
+        slowest = self.slowest_tasks()
+        # missing stages and models as null rather than NaN, which is not JSON
+        slowest = slowest.astype(object).where(slowest.notnull(), None)
+        with open(op.join(folder, f'{fragment}_profile.json'), 'w') as f:
+            json.dump({
+                'stages': self.stages,
+                'slowest_excerpts': slowest.to_dict(orient='records')
+            }, f, indent=2)
+        for name in sorted(self.cprofile_stages - {
+                name for name, model in self.cprofiles}):
+            warnings.warn(f'stage {name!r} was not run, so it was not '
+                          'profiled with cProfile')
+        for (name, model), profile in self.cprofiles.items():
+            suffix = name if model is None else f'{name}_{model}'
+            suffix = suffix.replace(' ', '_')
+            profile.dump_stats(
+                op.join(folder, f'{fragment}_{suffix}.prof'))
+        print(stages.to_string(index=False))
+
+
+class _Timed(object):
+    """Wrap a task function so that it also returns its run time; a class
+    rather than a closure so that it can be pickled to worker processes"""
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, task):
+        start = time.perf_counter()
+        result = self.func(task)
+        return result, time.perf_counter() - start
+
+
+def enable(cprofile_stages=()):
+    """Start profiling, see `Profiler`"""
+    global _profiler
+    _profiler = Profiler(cprofile_stages)
+    return _profiler
+
+
+def is_enabled():
+    return _profiler is not None
+
+
+def is_cprofiled(name):
+    """Whether the stage is to be run under cProfile"""
+    return _profiler is not None and name in _profiler.cprofile_stages
+
+
+def stage(name, model=None):
+    """Context manager recording a stage when profiling is enabled (and doing
+    nothing otherwise)"""
+    if _profiler is None:
+        return _nothing()
+    return _profiler.stage(name, model)
+
+
+@contextmanager
+def _nothing():
+    yield
+
+
+def timed(func):
+    """Wrap a task function as `_Timed` when profiling is enabled"""
+    return func if _profiler is None else _Timed(func)
+
+
+def add_tasks(names, seconds):
+    if _profiler is not None:
+        _profiler.add_tasks(names, seconds)
+
+
+def add_stage(name, model, wall, cpu):
+    """Record a stage timed elsewhere (such as in worker processes), added up
+    with earlier records of the stage"""
+    if _profiler is not None:
+        _profiler._add_stage(name, model, wall, cpu)
+
+
+def write(folder, fragment):
+    """Write the profile of the run, see `Profiler.write`"""
+    if _profiler is not None:
+        _profiler.write(folder, fragment)
+
+
+def _cpu_time():
+    """CPU time of this process and its finished child processes"""
+    times = os.times()
+    return (times.user + times.system + times.children_user
+            + times.children_system)
+
+
+def _peak_memory():
+    """Peak resident set size so far of this process and of its largest
+    finished child process, in MB"""
+    if resource is None:
+        return {}
+    # bytes on macOS, kilobytes elsewhere
+    unit = 2**20 if sys.platform == 'darwin' else 2**10
+    return {
+        'peak_rss_mb': resource.getrusage(
+            resource.RUSAGE_SELF).ru_maxrss / unit,
+        'peak_rss_children_mb': resource.getrusage(
+            resource.RUSAGE_CHILDREN).ru_maxrss / unit
+    }
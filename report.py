@@ -0,0 +1,372 @@
+"""Figures and tables of the scores of all models, written to the output
+folder of the config file. The scores themselves are computed by `cs`, `pitch`
+and `mirex2018`, which do not need the config file or the plotting libraries;
+these are only imported when a figure is drawn.
+
+The figures are drawn from small tables of aggregates (the means and
+bootstrapped confidence intervals of the line plots, the densities and
+quartiles of the violin plots) computed here with NumPy, rather than by
+seaborn from the scores of every excerpt, and `render_figures` draws them in
+parallel.
+"""
+import colorsys
+import os.path as op
+
+import numpy as np
+import pandas as pd
+
+import config
+from parallel import map_tasks
+
+# Number of bootstrap samples and width (in percent) of the confidence
+# intervals of the line plots, as drawn by seaborn's `lineplot`
+N_BOOT = 1000
+CI = 95
+# Number of points and extent beyond the data (in bandwidths) of the kernel
+# density estimates of the violin plots, as drawn by seaborn's `violinplot`
+GRIDSIZE = 100
+CUT = 2
+# Upper bound on the number of values resampled or summed at once
+BLOCK_SIZE = 2**24
+# Markers and line styles of the models in the line plots
+LINE_STYLES = {
+    'marker': ['o', 'v', 's', 'D'],
+    'linestyle': [':', '--', '-', '-.']
+}
+
+
+def score_table_path(name):
+    """The path of the CSV table of the scores `name` (e.g. 'cs') of all
+    excerpts in the output folder"""
+    return op.join(config.OUTPUT_FOLDER,
+                   f'{config.FILENAME_FRAGMENT}_{name}_scores.csv')
+
+
+def plot_cs(card_df):
+    """Plot the cardinality scores per onset of all models, as returned by
+    `score_cs`"""
+    _draw_figure(_cs_figure(card_df))
+
+
+def plot_pitch(scores_df):
+    """Plot the distributions of the pitch scores of all models, as returned
+    by `score_pitch`"""
+    _draw_figure(_pitch_figure(scores_df))
+
+
+def plot_sets(set_df):
+    """Plot the set scores per onset of all models, as returned by
+    `score_sets`"""
+    _draw_figure(_sets_figure(set_df))
+
+
+def render_figures(card_df=None, scores_df=None, set_df=None, n_jobs=1):
+    """Draw the figures of `plot_cs`, `plot_pitch` and `plot_sets` for the
+    scores that are given, each in a worker process if `n_jobs` is not 1"""
+    figures = []
+    if card_df is not None:
+        figures.append(_cs_figure(card_df))
+    if scores_df is not None:
+        figures.append(_pitch_figure(scores_df))
+    if set_df is not None:
+        figures.append(_sets_figure(set_df))
+    map_tasks(_draw_figure, figures, min(n_jobs, len(figures)) or 1,
+              chunksize=1)
+
+
+def mean_ci(data, by, value, n_boot=N_BOOT, ci=CI, seed=None):
+    '''The mean and bootstrapped confidence interval of the mean of a column
+    for every group, ignoring missing values.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        The table with the columns `by` and `value`
+    by : list[str]
+        The columns to group by
+    value : str
+        The column to average
+    n_boot : int, optional
+        The number of bootstrap samples
+    ci : float, optional
+        The width of the confidence interval, in percent
+    seed : int, optional
+        The seed of the random generator
+
+    Returns
+    -------
+    output : pd.DataFrame
+        A table with the columns `by`, `value` (the mean), 'low' and 'high'
+        (the bounds of the confidence interval), sorted by `by`
+    '''
+    data = data[by].assign(**{value: pd.to_numeric(data[value])})
+    data = data.dropna(subset=[value])
+    groups = data.groupby(by, sort=True)[value]
+    stats = groups.agg(['mean', 'size']).reset_index()
+    values = data[value].values[np.argsort(groups.ngroup().values,
+                                           kind='mergesort')]
+    sizes = stats['size'].values
+    starts = np.cumsum(sizes) - sizes
+    bounds = np.empty((len(stats), 2))
+    random = np.random.RandomState(seed)
+    # groups of the same size are resampled together, in blocks
+    for size in np.unique(sizes):
+        ids = np.flatnonzero(sizes == size)
+        samples = values[starts[ids, None] + np.arange(size)]
+        n_samples = min(n_boot, max(1, BLOCK_SIZE // size))
+        n_groups = max(1, BLOCK_SIZE // (n_samples * size))
+        for i in range(0, len(ids), n_groups):
+            block = samples[i:i + n_groups]
+            rows = np.arange(len(block))[:, None, None]
+            means = np.concatenate([
+                block[rows, random.randint(
+                    0, size, (len(block), min(n_samples, n_boot - j), size)
+                )].mean(axis=2)
+                for j in range(0, n_boot, n_samples)
+            ], axis=1)
+            bounds[ids[i:i + n_groups]] = np.percentile(
+                means, [50 - ci / 2, 50 + ci / 2], axis=1).T
+    return stats[by].assign(**{value: stats['mean'], 'low': bounds[:, 0],
+                               'high': bounds[:, 1]})
+
+
+def violin_table(data, by, value, gridsize=GRIDSIZE, cut=CUT):
+    '''The kernel density estimate (with Scott's bandwidth) and quartiles of
+    a column for every group, ignoring missing values.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        The table with the columns `by` and `value`
+    by : list[str]
+        The columns to group by
+    value : str
+        The column to estimate the density of
+    gridsize : int, optional
+        The number of points the density is evaluated at
+    cut : float, optional
+        How far (in bandwidths) the density extends beyond the data
+
+    Returns
+    -------
+    output : pd.DataFrame
+        A table with the columns `by`, `value` (the points) and 'density'
+        (scaled to a maximum of 1) for every point, and 'q25', 'q50', 'q75',
+        'low' and 'high' (the whiskers at 1.5 times the interquartile range)
+        repeated for every point. Groups with a single distinct value get a
+        single point.
+    '''
+    tables = []
+    for keys, values in data.groupby(by, sort=False)[value]:
+        values = pd.to_numeric(values).dropna().values
+        if len(values) == 0:
+            continue
+        bandwidth = 0.
+        if len(values) > 1:
+            bandwidth = len(values) ** -0.2 * values.std(ddof=1)
+        if bandwidth > 0:
+            points = np.linspace(values.min() - cut * bandwidth,
+                                 values.max() + cut * bandwidth, gridsize)
+            density = _gaussian_kde(values, points, bandwidth)
+            density /= density.max()
+        else:
+            points = values[:1]
+            density = np.ones(1)
+        q25, q50, q75 = np.percentile(values, [25, 50, 75])
+        whisker = 1.5 * (q75 - q25)
+        keys = keys if isinstance(keys, tuple) else (keys,)
+        tables.append(pd.DataFrame(dict(
+            zip(by, keys), **{
+                value: points, 'density': density, 'q25': q25, 'q50': q50,
+                'q75': q75, 'low': values[values >= q25 - whisker].min(),
+                'high': values[values <= q75 + whisker].max()
+            }), columns=by + [value, 'density', 'q25', 'q50', 'q75', 'low',
+                              'high']))
+    return pd.concat(tables, ignore_index=True)
+
+
+def _gaussian_kde(values, points, bandwidth):
+    """The (unnormalised) Gaussian kernel density of `values` at `points`"""
+    density = np.zeros(len(points))
+    step = max(1, BLOCK_SIZE // len(points))
+    for i in range(0, len(values), step):
+        distances = (points[:, None] - values[None, i:i + step]) / bandwidth
+        density += np.exp(-0.5 * distances ** 2).sum(axis=1)
+    return density
+
+
+def _cs_figure(card_df):
+    """The description of the figure of `plot_cs`, for `_draw_figure`"""
+    data = card_df.melt(
+        id_vars=['fn', 'Onset', 'Model'],
+        value_vars=['Precision', 'Recall', 'F1'],
+        var_name="measure",
+        value_name="Score"
+    )
+    return {
+        'kind': 'line',
+        'data': mean_ci(data, ['measure', 'Model', 'Onset'], 'Score'),
+        'facets': {'col': 'measure',
+                   'col_order': ['Precision', 'Recall', 'F1']},
+        'models': list(config.MODEL_DIRS.keys()),
+        'filename': op.join(config.OUTPUT_FOLDER, '{}_cs_scores.png'.format(
+            config.FILENAME_FRAGMENT))
+    }
+
+
+def _pitch_figure(scores_df):
+    """The description of the figure of `plot_pitch`, for `_draw_figure`"""
+    data = scores_df.melt(
+        id_vars=['fn', 'Model'],
+        value_vars=['Pitch', 'Modulo12Pitch'],
+        var_name='score')
+    return {
+        'kind': 'violin',
+        'data': violin_table(data, ['score', 'Model'], 'value'),
+        'facets': {'col': 'score', 'col_order': ['Pitch', 'Modulo12Pitch']},
+        'models': list(config.MODEL_DIRS.keys()),
+        'filename': op.join(
+            config.OUTPUT_FOLDER,
+            '{}_pitch_scores.png'.format(config.FILENAME_FRAGMENT))
+    }
+
+
+def _sets_figure(set_df):
+    """The description of the figure of `plot_sets`, for `_draw_figure`"""
+    data = set_df.melt(
+        id_vars=['fn', 'Onset', 'Set', 'Model'],
+        value_vars=['Precision', 'Recall', 'F1'],
+        var_name='measure',
+        value_name='Score'
+    )
+    return {
+        'kind': 'line',
+        'data': mean_ci(data, ['Set', 'measure', 'Model', 'Onset'], 'Score'),
+        'facets': {'row': 'Set', 'row_order': ['Pitch', 'IOI', 'Pitch-IOI'],
+                   'col': 'measure',
+                   'col_order': ['Precision', 'Recall', 'F1']},
+        'models': list(config.MODEL_DIRS.keys()),
+        'filename': op.join(config.OUTPUT_FOLDER, '{}_set_scores.png'.format(
+            config.FILENAME_FRAGMENT))
+    }
+
+
+def _draw_figure(figure):
+    """Draw and save a figure described by `_cs_figure`, `_pitch_figure` or
+    `_sets_figure`; this only needs the small tables of aggregates, so it is
+    cheap to send to a worker process"""
+    # imported here, as the plotting libraries are slow to import
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    sns.set_style("whitegrid")
+    data = figure['data']
+    facets = dict(figure['facets'])
+    for facet in ('row', 'col'):
+        if facet in facets:
+            # leave out the facets without scores
+            levels = set(data[facets[facet]])
+            facets[f'{facet}_order'] = [
+                level for level in facets[f'{facet}_order']
+                if level in levels]
+    if figure['kind'] == 'line':
+        g = sns.FacetGrid(data, hue='Model', hue_order=figure['models'],
+                          hue_kws=LINE_STYLES, **facets)
+        g = g.map_dataframe(_draw_lines, 'Onset', 'Score').add_legend()
+    else:
+        g = sns.FacetGrid(data, hue='Model', hue_order=figure['models'],
+                          **facets)
+        g = g.map_dataframe(_draw_violin, 'value', 'Model',
+                            order=figure['models'])
+    plt.savefig(figure['filename'], dpi=300)
+    plt.close()
+
+
+def _draw_lines(x, y, data=None, color=None, label=None, **kwargs):
+    """Draw the means `y` against `x` with a band for the confidence
+    interval, like seaborn's `lineplot`"""
+    import matplotlib.pyplot as plt
+    data = data.sort_values(x)
+    ax = plt.gca()
+    ax.plot(data[x].values, data[y].values, color=color, label=label,
+            markeredgewidth=.75, markeredgecolor='w', **kwargs)
+    ax.fill_between(data[x].values, data['low'].values,
+                    data['high'].values, color=color, alpha=.2)
+
+
+def _draw_violin(x, y, data=None, color=None, label=None, order=None):
+    """Draw a horizontal violin with a box plot inside from a table of
+    `violin_table`, like seaborn's `violinplot`"""
+    import matplotlib as mpl
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    ax = plt.gca()
+    color = sns.desaturate(color, .75)
+    lightness = colorsys.rgb_to_hls(*mpl.colors.to_rgb(color))[1]
+    gray = mpl.colors.rgb2hex((lightness * .6,) * 3)
+    linewidth = mpl.rcParams['lines.linewidth']
+    for model, violin in data.groupby(y, sort=False):
+        center = order.index(model)
+        points = violin[x].values
+        width = violin['density'].values * .4
+        if len(points) == 1:
+            ax.plot([points[0], points[0]],
+                    [center - width[0], center + width[0]],
+                    color=gray, linewidth=linewidth)
+            continue
+        ax.fill_between(points, center - width, center + width,
+                        facecolor=color, edgecolor=gray, linewidth=linewidth)
+        stats = violin.iloc[0]
+        ax.plot([stats['low'], stats['high']], [center, center],
+                linewidth=linewidth, color=gray)
+        ax.plot([stats['q25'], stats['q75']], [center, center],
+                linewidth=linewidth * 3, color=gray)
+        ax.scatter(stats['q50'], center, zorder=3, color='white',
+                   edgecolor=gray, s=np.square(linewidth * 2))
+    ax.set_yticks(np.arange(len(order)))
+    ax.set_yticklabels(order)
+    ax.yaxis.grid(False)
+    ax.set_ylim(len(order) - .5, -.5)
+
+
+def write_pitch_tables(scores_df):
+    """Write tables of the mean, median and standard deviation of the pitch
+    scores of all models, as returned by `score_pitch`, with the confidence
+    interval of the mean and the p-value of the difference with the best
+    model (see `significance.significance_table`)"""
+    from significance import significance_table
+    for value, name in (('Pitch', 'pitch'),
+                        ('Modulo12Pitch', 'pitch_no_octave')):
+        stats = scores_df.groupby('Model').agg({value: ['mean', 'median',
+                                                        'std']})
+        tests = significance_table(scores_df, value)
+        for column in tests.columns:
+            stats[(value, column)] = tests[column]
+        rounded_pitch_score_table = stats.round(decimals=3)
+        filename = op.join(config.OUTPUT_FOLDER, '{}_{}_table'.format(
+            config.FILENAME_FRAGMENT, name))
+        rounded_pitch_score_table.to_html(filename + '.html')
+        rounded_pitch_score_table.to_latex(filename + '.tex')
+
+
+def write_cs_table(card_df):
+    """Write a table of the cardinality scores of all models, as returned by
+    `score_cs`: the mean, median and standard deviation over the excerpts of
+    the mean score over the onsets of an excerpt, with the confidence
+    interval of the mean and the p-value of the difference with the best
+    model (see `significance.significance_table`)"""
+    from significance import significance_table
+    measures = ['Precision', 'Recall', 'F1']
+    excerpt_scores = card_df.astype(dict.fromkeys(measures, float)).groupby(
+        ['Model', 'fn'])[measures].mean()
+    stats = excerpt_scores.groupby('Model').agg(['mean', 'median', 'std'])
+    excerpt_scores = excerpt_scores.reset_index()
+    for measure in measures:
+        tests = significance_table(excerpt_scores, measure)
+        for column in tests.columns:
+            stats[(measure, column)] = tests[column]
+    stats = stats[measures]
+    rounded_cs_score_table = stats.round(decimals=3)
+    filename = op.join(config.OUTPUT_FOLDER, '{}_cs_table'.format(
+        config.FILENAME_FRAGMENT))
+    rounded_cs_score_table.to_html(filename + '.html')
+    rounded_cs_score_table.to_latex(filename + '.tex')
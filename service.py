@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+"""Local HTTP service scoring generated continuations against the PPTD, with
+the primes and true continuations read once and kept in memory.
+
+Requests are JSON objects POSTed to /score, for one excerpt:
+    {"fn": "<file name of the excerpt>",
+     "onset": [...], "pitch": [...]}
+or with the generated continuation as the text of a csv file (without header,
+with the columns given by "columns", by default onset and pitch):
+    {"fn": "...", "csv": "60.0,62\\n60.5,64\\n", "columns": ["onset", "pitch"]}
+A list of such objects scores several excerpts at once. The response has,
+for every excerpt, the cardinality scores per onset ("cs", as in the tables
+of `evaluate_prediction.py`) and the pitch scores ("Pitch" and
+"Modulo12Pitch"). GET /excerpts lists the file names of the excerpts.
+
+Requests arriving at the same time are scored together, so that the pitch
+scores of all of them are computed in one vectorised call.
+"""
+import argparse
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import io
+import json
+import queue
+from socketserver import ThreadingMixIn
+import threading
+
+import numpy as np
+import pandas as pd
+
+from cache import COLNAMES, get_fn, read_csv_dir, read_last_row
+from corpus import dedup_and_preproc, deduplicate
+from cs import (EVALUATE_FROM_ONSET, EVALUATE_UNTIL_ONSET, ONSET_INCREMENT,
+                continuation_scores)
+from pitch import evaluate_pitch_score, evaluate_pitch_scores, pitch_histograms
+
+# Maximum number of excerpts scored together, and the time (in seconds) to
+# wait for other requests before scoring a batch
+MAX_BATCH = 256
+BATCH_WAIT = 0.002
+
+
+class ScoringService(object):
+    '''The true continuations and the last onsets of the primes of a dataset,
+    kept in memory to score generated continuations against.
+
+    Parameters
+    ----------
+    prime : corpus.Corpus
+        The primes, or only their last events (see `cache.read_last_row`)
+    cont_true : corpus.Corpus
+        The deduplicated true continuations
+    '''
+    def __init__(self, prime, cont_true):
+        self.cont_true = cont_true
+        self.prime_final_onsets = {
+            fn: float(prime.points(fn)[0][-1]) for fn in cont_true.keys()
+            if fn in prime
+        }
+        self.true_counts = pitch_histograms(cont_true.pitches,
+                                            cont_true.offsets)
+
+    def score(self, excerpts):
+        '''Score a batch of generated continuations.
+
+        Parameters
+        ----------
+        excerpts : list[tuple]
+            Pairs of the file name of an excerpt and the generated
+            continuation, as a deduplicated dataframe with columns 'onset'
+            and 'pitch'
+
+        Returns
+        -------
+        output : list[dict]
+            For every excerpt, the cardinality scores per onset ('cs', a
+            dictionary of lists) and the pitch scores ('Pitch' and
+            'Modulo12Pitch')
+        '''
+        for fn, generated in excerpts:
+            if fn not in self.prime_final_onsets:
+                raise KeyError(fn)
+        results = []
+        for fn, generated in excerpts:
+            onsets, pitches = self.cont_true.points(fn)
+            results.append({'fn': fn, 'cs': continuation_scores(
+                np.column_stack((onsets, pitches)).astype(float),
+                generated[['onset', 'pitch']].values.astype(float),
+                self.prime_final_onsets[fn], ONSET_INCREMENT,
+                EVALUATE_FROM_ONSET, EVALUATE_UNTIL_ONSET
+            )})
+        generated_pitches = [generated['pitch'].values
+                             for fn, generated in excerpts]
+        lengths = [len(pitches) for pitches in generated_pitches]
+        generated_counts = pitch_histograms(
+            np.concatenate([np.zeros(0)] + generated_pitches),
+            np.concatenate(([0], np.cumsum(lengths))))
+        if self.true_counts is not None and generated_counts is not None:
+            slots = [self.cont_true.index[fn] for fn, generated in excerpts]
+            pitch_scores = zip(*evaluate_pitch_scores(
+                self.true_counts[slots], generated_counts))
+        else:
+            # pitches outside the MIDI range: score the excerpts one by one
+            pitch_scores = [
+                (evaluate_pitch_score(self.cont_true[fn], generated),
+                 evaluate_pitch_score(self.cont_true[fn], generated,
+                                      ignore_octave=True))
+                for fn, generated in excerpts
+            ]
+        for result, (pitch_score, pitch_score_nooctave) in zip(
+                results, pitch_scores):
+            result['Pitch'] = pitch_score
+            result['Modulo12Pitch'] = pitch_score_nooctave
+        return results
+
+
+class Batcher(object):
+    '''Collect the excerpts submitted by concurrent requests, and score them
+    in batches with a `ScoringService` on a background thread.
+
+    Parameters
+    ----------
+    service : ScoringService
+        The service scoring the batches
+    max_batch : int, optional
+        The maximum number of excerpts in a batch
+    wait : float, optional
+        The time to wait for more excerpts before scoring a batch
+    '''
+    def __init__(self, service, max_batch=MAX_BATCH, wait=BATCH_WAIT):
+        self.service = service
+        self.max_batch = max_batch
+        self.wait = wait
+        self.queue = queue.Queue()
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+
+    def score(self, excerpts):
+        """Score a list of (file name, dataframe) pairs, see
+        `ScoringService.score`; blocks until the scores are ready"""
+        futures = []
+        for excerpt in excerpts:
+            future = Future()
+            self.queue.put((excerpt, future))
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < self.max_batch:
+                    batch.append(self.queue.get(timeout=self.wait))
+            except queue.Empty:
+                pass
+            try:
+                results = self.service.score(
+                    [excerpt for excerpt, future in batch])
+            except Exception:
+                # score the excerpts separately, so that only the requests
+                # for unknown or invalid excerpts fail
+                for excerpt, future in batch:
+                    try:
+                        future.set_result(self.service.score([excerpt])[0])
+                    except Exception as error:
+                        future.set_exception(error)
+                continue
+            for (excerpt, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+def parse_excerpt(request):
+    """The file name and deduplicated generated continuation of one excerpt
+    of a request, see the module docstring for the format; raises a
+    `ValueError`, `KeyError` or `TypeError` for an invalid excerpt"""
+    if not isinstance(request.get('fn'), str):
+        raise TypeError('"fn" should be the file name of an excerpt')
+    if 'csv' in request:
+        generated = pd.read_csv(io.StringIO(request['csv']),
+                                names=request.get('columns', ['onset',
+                                                              'pitch']))
+    else:
+        onsets = np.asarray(request['onset'], dtype=float)
+        pitches = np.asarray(request['pitch'], dtype=float)
+        if onsets.ndim != 1 or onsets.shape != pitches.shape:
+            raise ValueError('"onset" and "pitch" should be lists of numbers '
+                             'of the same length')
+        generated = pd.DataFrame({'onset': onsets, 'pitch': pitches})
+    generated = generated[['onset', 'pitch']].astype(float)
+    if not np.all(np.isfinite(generated.values)):
+        raise ValueError('the onsets and pitches should be finite numbers')
+    return request['fn'], dedup_and_preproc(generated)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # connections waiting to be accepted; many clients may send at once
+    request_queue_size = 128
+
+
+class _Handler(BaseHTTPRequestHandler):
+    batcher = None
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/excerpts':
+            return self._reply(404, {'error': f'unknown path {self.path}'})
+        service = self.batcher.service
+        self._reply(200, sorted(service.prime_final_onsets))
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/score':
+            return self._reply(404, {'error': f'unknown path {self.path}'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode())
+            requests = request if isinstance(request, list) else [request]
+            excerpts = [parse_excerpt(item) for item in requests]
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            return self._reply(400, {'error': f'invalid request: {error!r}'})
+        try:
+            results = self.batcher.score(excerpts)
+        except KeyError as error:
+            return self._reply(404, {'error': f'unknown excerpt {error}'})
+        except Exception as error:
+            self.log_error('error scoring a request: %r', error)
+            return self._reply(500, {'error': f'scoring failed: {error!r}'})
+        self._reply(200, results if isinstance(request, list) else results[0])
+
+    def _reply(self, status, content):
+        body = json.dumps(content, default=_to_builtin).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_request(self, code='-', size='-'):
+        # keep the console quiet: one line per request is too much (errors
+        # are still logged)
+        pass
+
+
+def _to_builtin(value):
+    """Convert the NumPy values in the scores to types JSON can encode"""
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    raise TypeError(f'Cannot encode a {type(value).__name__}')
+
+
+def serve(service, host='127.0.0.1', port=8000):
+    """Serve `service` over HTTP until interrupted"""
+    _Handler.batcher = Batcher(service)
+    server = _Server((host, port), _Handler)
+    print(f'Scoring service listening on http://{host}:{port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='port to listen on (default: 8000)')
+    parser.add_argument(
+        '--cache-dir',
+        help='directory to cache the parsed csv files in between runs'
+    )
+    args = parser.parse_args()
+
+    import config
+    PATH = config.DATASET_PATH
+    print('Reading PPTD csv files')
+    prime = read_csv_dir(f'{PATH}/prime_csv/*', COLNAMES,
+                         cache_dir=args.cache_dir, key=get_fn,
+                         reader=read_last_row)
+    cont_true = deduplicate(read_csv_dir(f'{PATH}/cont_true_csv/*', COLNAMES,
+                                         cache_dir=args.cache_dir, key=get_fn))
+    serve(ScoringService(prime, cont_true), args.host, args.port)
@@ -0,0 +1,172 @@
+"""Bootstrapped confidence intervals and paired permutation tests of the mean
+scores of several models, from matrices of the scores of every model on the
+same excerpts (or rows of the discrimination files).
+
+All resamples are drawn at once (in blocks of at most `BLOCK_SIZE` values)
+and averaged with one matrix product, rather than resampling a dataframe once
+per resample.
+"""
+import numpy as np
+import pandas as pd
+
+# Number of bootstrap samples and of permutations
+N_RESAMPLES = 10000
+# Width (in percent) of the confidence intervals
+CI = 95
+# Upper bound on the number of values resampled at once
+BLOCK_SIZE = 2**24
+# Permuted mean differences within this distance of the observed difference
+# count as at least as large, so that rounding errors do not decide the test
+TOLERANCE = 1e-12
+
+
+def bootstrap_ci(scores, n_boot=N_RESAMPLES, ci=CI, seed=0):
+    '''Bootstrapped confidence intervals of the mean score of every model.
+
+    Parameters
+    ----------
+    scores : np.ndarray
+        The scores, one row per model and one column per excerpt; the
+        excerpts are resampled together for all models
+    n_boot : int, optional
+        The number of bootstrap samples
+    ci : float, optional
+        The width of the confidence intervals, in percent
+    seed : int, optional
+        The seed of the random generator
+
+    Returns
+    -------
+    bounds : np.ndarray
+        The lower and upper bound of the confidence interval of every model,
+        in an array of shape (number of models, 2)
+    '''
+    scores = np.atleast_2d(np.asarray(scores, dtype=float))
+    nr_models, size = scores.shape
+    if size == 0:
+        return np.full((nr_models, 2), np.nan)
+    random = np.random.RandomState(seed)
+    n_samples = max(1, BLOCK_SIZE // size)
+    means = []
+    for i in range(0, n_boot, n_samples):
+        n = min(n_samples, n_boot - i)
+        samples = random.randint(0, size, (n, size))
+        # the number of times every excerpt is drawn in every sample, so
+        # that the means of all models are one matrix product
+        counts = np.bincount(
+            (np.arange(n)[:, None] * size + samples).ravel(),
+            minlength=n * size
+        ).reshape(n, size)
+        means.append(counts @ scores.T / size)
+    return np.percentile(np.concatenate(means), [50 - ci / 2, 50 + ci / 2],
+                         axis=0).T
+
+
+def permutation_tests(differences, n_perm=N_RESAMPLES, seed=0):
+    '''Two-sided paired permutation tests that the mean difference between
+    the scores of two models is zero, by flipping the signs of the
+    differences at random.
+
+    Parameters
+    ----------
+    differences : np.ndarray
+        The differences between the scores of two models, one row per pair
+        of models and one column per excerpt
+    n_perm : int, optional
+        The number of permutations
+    seed : int, optional
+        The seed of the random generator
+
+    Returns
+    -------
+    p_values : np.ndarray
+        The p-value of every pair of models
+    '''
+    differences = np.atleast_2d(np.asarray(differences, dtype=float))
+    nr_tests, size = differences.shape
+    if size == 0:
+        return np.full(nr_tests, np.nan)
+    observed = np.abs(differences.mean(axis=1)) - TOLERANCE
+    random = np.random.RandomState(seed)
+    n_samples = max(1, BLOCK_SIZE // size)
+    exceeding = np.zeros(nr_tests)
+    for i in range(0, n_perm, n_samples):
+        n = min(n_samples, n_perm - i)
+        # one random bit per sign, much faster to draw than integers
+        signs = np.unpackbits(np.frombuffer(
+            random.bytes(-(-n * size // 8)), dtype=np.uint8)
+        )[:n * size].reshape(n, size) * 2.0 - 1
+        means = np.abs(signs @ differences.T) / size
+        exceeding += np.sum(means >= observed, axis=0)
+    # the observed differences count as one of the permutations
+    return (exceeding + 1) / (n_perm + 1)
+
+
+def significance_table(data, value, by='Model', on='fn',
+                       n_resamples=N_RESAMPLES, ci=CI, seed=0):
+    '''The confidence interval of the mean of a column for every model, and
+    the p-value of the difference with the model with the highest mean.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        The table with the columns `by`, `on` and `value`; if there are
+        several rows per model and excerpt (such as the scores per onset of
+        `cs.score_cs`), their mean is the score of the excerpt
+    value : str
+        The column of the scores
+    by : str, optional
+        The column of the models
+    on : str, optional
+        The column of the excerpts. Every model is resampled on the excerpts
+        it has a score for (as the mean, median and standard deviation of its
+        scores are computed), and the tests use the excerpts both models have
+        a score for.
+    n_resamples : int, optional
+        The number of bootstrap samples and of permutations
+    ci : float, optional
+        The width of the confidence intervals, in percent
+    seed : int, optional
+        The seed of the random generator
+
+    Returns
+    -------
+    output : pd.DataFrame
+        A table indexed by model, with the columns 'ci_low' and 'ci_high'
+        (the bounds of the confidence interval), and 'p_vs_best' (empty for
+        the best model)
+    '''
+    scores = data.assign(**{value: pd.to_numeric(data[value])}).pivot_table(
+        index=on, columns=by, values=value, aggfunc='mean', dropna=False)
+    matrix = scores.values.T
+    scored = ~np.isnan(matrix)
+    bounds = np.full((len(matrix), 2), np.nan)
+    means = np.full(len(matrix), np.nan)
+    # models scored on the same excerpts (normally all of them) are
+    # resampled together
+    for rows, mask in _group_by_mask(scored):
+        if mask.any():
+            bounds[rows] = bootstrap_ci(matrix[np.ix_(rows, mask)],
+                                        n_resamples, ci, seed)
+            means[rows] = matrix[np.ix_(rows, mask)].mean(axis=1)
+    p_values = np.full(len(matrix), np.nan)
+    if len(matrix) > 1 and scored.any():
+        best = np.nanargmax(means)
+        others = [i for i in range(len(matrix)) if i != best]
+        for rows, shared in _group_by_mask(scored[others] & scored[best]):
+            rows = [others[i] for i in rows]
+            p_values[rows] = permutation_tests(
+                matrix[best, shared] - matrix[np.ix_(rows, shared)],
+                n_resamples, seed)
+    return pd.DataFrame({'ci_low': bounds[:, 0], 'ci_high': bounds[:, 1],
+                         'p_vs_best': p_values},
+                        index=pd.Index(scores.columns, name=by))
+
+
+def _group_by_mask(masks):
+    """Group the rows of a boolean matrix by their values, as (list of row
+    indices, mask) pairs"""
+    groups = {}
+    for i, mask in enumerate(masks):
+        groups.setdefault(mask.tobytes(), ([], mask))[0].append(i)
+    return list(groups.values())
@@ -0,0 +1,128 @@
+"""Persistent store of per-excerpt scores, keyed on a hash of the inputs of
+each score, so that re-running an evaluation only computes the scores of
+excerpts or models whose inputs changed."""
+import hashlib
+import json
+import sqlite3
+
+import numpy as np
+
+from parallel import map_tasks
+
+# Part of every key; increase it when the scores themselves change, so that
+# outdated results are not reused
+STORE_VERSION = 1
+# Maximum number of keys looked up in one query
+QUERY_SIZE = 500
+
+
+class ResultStore(object):
+    '''A SQLite file mapping keys (hashes of the inputs of a score) to the
+    JSON encoded results.
+
+    Parameters
+    ----------
+    path : str
+        The path of the SQLite file, which is created if it does not exist
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS results '
+            '(key TEXT PRIMARY KEY, value TEXT NOT NULL)'
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def lookup(self, keys):
+        """Return a dictionary with the stored result of every key in `keys`
+        that is in the store"""
+        keys = list(keys)
+        found = {}
+        for start in range(0, len(keys), QUERY_SIZE):
+            chunk = keys[start:start + QUERY_SIZE]
+            rows = self.connection.execute(
+                'SELECT key, value FROM results WHERE key IN ({})'.format(
+                    ','.join('?' * len(chunk))),
+                chunk
+            )
+            found.update((key, json.loads(value)) for key, value in rows)
+        return found
+
+    def save(self, keys, results):
+        """Store the result of every key"""
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)',
+            [(key, json.dumps(result, default=_to_builtin))
+             for key, result in zip(keys, results)]
+        )
+        self.connection.commit()
+
+    def map_tasks(self, func, tasks, name, n_jobs=1, chunksize=None,
+                  names=None):
+        '''Like `parallel.map_tasks`, but only apply `func` to the tasks
+        whose results are not in the store yet, and store those results.
+
+        Parameters
+        ----------
+        func : callable
+            The scoring function, see `parallel.map_tasks`
+        tasks : list
+            The tasks, tuples of arrays and numbers which form the key
+        name : str
+            Name of the score and its parameters, which is part of the key
+        n_jobs : int, optional
+            The number of worker processes
+        chunksize : int, optional
+            The number of tasks sent to a worker at once
+        names : list of str, optional
+            Names of the tasks, see `parallel.map_tasks`
+
+        Returns
+        -------
+        output : list
+            The result of `func` for each task
+        '''
+        tasks = list(tasks)
+        names = None if names is None else list(names)
+        keys = [task_key(name, task) for task in tasks]
+        found = self.lookup(keys)
+        missing = [i for i, key in enumerate(keys) if key not in found]
+        if missing:
+            results = map_tasks(
+                func, [tasks[i] for i in missing], n_jobs, chunksize,
+                None if names is None else [names[i] for i in missing])
+            self.save([keys[i] for i in missing], results)
+            found.update(zip([keys[i] for i in missing], results))
+        print(f'{len(tasks) - len(missing)} of {len(tasks)} scores found '
+              'in the result store')
+        return [found[key] for key in keys]
+
+
+def task_key(name, task):
+    """Hash the name of a score and the arrays and numbers of a task into a
+    key. Arrays are hashed by value (as float64), so the key does not depend
+    on how compactly they are stored."""
+    digest = hashlib.sha1(f'{STORE_VERSION}|{name}'.encode())
+    for item in task:
+        if isinstance(item, np.ndarray):
+            values = np.ascontiguousarray(item, dtype=np.float64)
+            digest.update(f'|array{len(values)}:'.encode())
+            digest.update(values.tobytes())
+        else:
+            digest.update(f'|{item!r}'.encode())
+    return digest.hexdigest()
+
+
+def _to_builtin(value):
+    """Convert the NumPy values in results to types JSON can encode"""
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f'Cannot store a {type(value).__name__}')
@@ -0,0 +1,152 @@
+"""Evaluation of the prediction task one excerpt at a time: only the final
+onset of the prime, the true continuation and the matching output of each
+model are in memory for an excerpt, and the scores are appended to tables on
+disk, so memory use does not grow with the size of the dataset or the number
+of models."""
+from glob import glob
+
+import pandas as pd
+
+from cache import COLNAMES, get_fn, read_last_row
+from corpus import dedup_and_preproc
+from cs import (EVALUATE_FROM_ONSET, EVALUATE_UNTIL_ONSET, ONSET_INCREMENT,
+                continuation_scores_models)
+from matching import match_model_outputs
+from mirex2018 import evaluate_sets
+from parallel import imap_tasks
+import profiling
+from pitch import pitch_scores_models
+
+
+def excerpt_tasks(dataset_path, model_dirs, model_keys):
+    '''List the files to score for every excerpt, without reading them.
+
+    Parameters
+    ----------
+    dataset_path : str
+        The directory containing the 'prime_csv' and 'cont_true_csv'
+        directories
+    model_dirs : dict[str, str]
+        The output directory of every model
+    model_keys : dict[str, list[str]]
+        The column names of the output files of every model
+
+    Returns
+    -------
+    output : list[tuple]
+        For every excerpt a tuple of the file name, the path of the prime, the
+        path of the true continuation and a list of (model, path of the
+        generated continuation, column names) tuples
+    '''
+    prime_paths = glob(f'{dataset_path}/prime_csv/*')
+    true_paths = {get_fn(path): path
+                  for path in glob(f'{dataset_path}/cont_true_csv/*')}
+    fn_list = [get_fn(path) for path in prime_paths]
+    outputs = {
+        alg: {get_fn(path): path for path in glob(f'{model_dir}/*.csv')}
+        for alg, model_dir in model_dirs.items()
+    }
+    matches = match_model_outputs(fn_list, outputs)
+    return [
+        (fn, prime_path, true_paths[fn],
+         [(alg, outputs[alg][matches[alg][fn]], model_keys[alg])
+          for alg in model_dirs])
+        for fn, prime_path in zip(fn_list, prime_paths)
+    ]
+
+
+def score_excerpt(task):
+    '''Read and score one excerpt, as listed by `excerpt_tasks`, for all
+    models.
+
+    Returns
+    -------
+    card_df : pd.DataFrame
+        The cardinality scores per onset, as in `cs.score_cs`
+    scores_df : pd.DataFrame
+        The pitch scores, as in `pitch.score_pitch`
+    set_df : pd.DataFrame
+        The set scores per onset, as in `mirex2018.score_sets`
+    '''
+    fn, prime_path, true_path, outputs = task
+    prime_final_onset = read_last_row(prime_path, COLNAMES)['onset'].iloc[-1]
+    true_df = dedup_and_preproc(pd.read_csv(true_path, names=COLNAMES))
+    gen_dfs = [dedup_and_preproc(pd.read_csv(path, names=names))
+               for alg, path, names in outputs]
+    # the true continuation is prepared once for all models
+    cs_scores = continuation_scores_models(
+        true_df[['onset', 'pitch']].values.astype(float),
+        [gen_df[['onset', 'pitch']].values.astype(float)
+         for gen_df in gen_dfs],
+        prime_final_onset,
+        ONSET_INCREMENT, EVALUATE_FROM_ONSET, EVALUATE_UNTIL_ONSET
+    )
+    pitch_model_scores = pitch_scores_models(
+        true_df['pitch'].values,
+        [gen_df['pitch'].values for gen_df in gen_dfs])
+    card_scores = []
+    pitch_scores = []
+    set_scores = []
+    for i, (alg, path, names) in enumerate(outputs):
+        gen_df = gen_dfs[i]
+        pitch_score, pitch_nooctave = pitch_model_scores[i]
+        cs_score = pd.DataFrame(cs_scores[i])
+        cs_score['fn'] = fn
+        cs_score['Model'] = alg
+        card_scores.append(cs_score)
+        set_score = evaluate_sets(
+            true_df,
+            gen_df,
+            prime_final_onset,
+            ONSET_INCREMENT, EVALUATE_FROM_ONSET, EVALUATE_UNTIL_ONSET
+        )
+        set_score['fn'] = fn
+        set_score['Model'] = alg
+        set_scores.append(set_score)
+        pitch_scores.append(
+            {'fn': fn,
+             'Pitch': pitch_score,
+             'Modulo12Pitch': pitch_nooctave,
+             'Model': alg}
+        )
+    return (pd.concat(card_scores, axis=0), pd.DataFrame(pitch_scores),
+            pd.concat(set_scores, axis=0))
+
+
+def score_streaming(dataset_path, model_dirs, model_keys, cs_path,
+                    pitch_path, set_path, n_jobs=1, chunksize=None):
+    '''Score all excerpts one at a time (or one per worker process), writing
+    the cardinality scores to `cs_path`, the pitch scores to `pitch_path` and
+    the set scores to `set_path` as CSV tables. Existing tables at these paths
+    are overwritten.
+
+    Parameters
+    ----------
+    dataset_path : str
+        The directory containing the 'prime_csv' and 'cont_true_csv'
+        directories
+    model_dirs : dict[str, str]
+        The output directory of every model
+    model_keys : dict[str, list[str]]
+        The column names of the output files of every model
+    cs_path : str
+        The path of the table of cardinality scores
+    pitch_path : str
+        The path of the table of pitch scores
+    set_path : str
+        The path of the table of set scores
+    n_jobs : int, optional
+        The number of worker processes, see `parallel.map_tasks`
+    chunksize : int, optional
+        The number of excerpts sent to a worker at once
+    '''
+    with profiling.stage('match'):
+        tasks = excerpt_tasks(dataset_path, model_dirs, model_keys)
+    print(f'Scoring {len(tasks)} excerpts')
+    with profiling.stage('score'):
+        results = imap_tasks(score_excerpt, tasks, n_jobs, chunksize,
+                             len(tasks), [task[0] for task in tasks])
+        for i, tables in enumerate(results):
+            mode = 'w' if i == 0 else 'a'
+            for df, path in zip(tables, (cs_path, pitch_path, set_path)):
+                df.to_csv(path, mode=mode, header=i == 0, index=False)